@@ -1,34 +1,92 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import sqlalchemy
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
 from sqlalchemy.ext.declarative import api
 
-# logging
-import logging
-from logging.handlers import RotatingFileHandler
 import os
 
 from redis import Redis
-import rq
 
 from config import Config, DevelopmentConfig, ProductionConfig
 
-db = SQLAlchemy()
+from app.replicas import RoutingSQLAlchemy
+
+# NOTE: the reads may go to the replicas of `SQLALCHEMY_REPLICA_URIS`,
+# see `app.replicas.RoutingSession`.
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
+
+# NOTE: a process forked after the engine was used (rq work horses, gunicorn
+# `--preload`) must not share the pooled connections of its parent. redis-py
+# already resets its pool after a fork, these listeners do the same for
+# SQLAlchemy, so every process opens its own connections on first use.
+@event.listens_for(Pool, 'connect')
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    if connection_record.info['pid'] != os.getpid():
+        # drop the connection without closing it, it belongs to the parent.
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError('connection record belongs to pid {}, '
+                                     'attempting to check out in pid {}'.format(
+                                         connection_record.info['pid'], os.getpid()))
+
 def create_app(config=DevelopmentConfig):
     app = Flask(__name__)
     app.config.from_object(Config)
 
     db.init_app(app)
     migrate.init_app(app, db)
+    from app.replicas import Replicas
+    app.replicas = Replicas(app, db)
 
     # using redis as task queue
-    app.redis = Redis.from_url(app.config['REDIS_URL'])
+    redis_class = Redis
+    if app.config['METRICS_ENABLED']:
+        # counts the redis commands of every request.
+        from app.metrics import InstrumentedRedis as redis_class
+    app.redis = redis_class.from_url(app.config['REDIS_URL'])
     # NOTE: define the `app.task_queue` in order to
     # access the queue with `current_app.task_queue` at somewhere else.
-    app.task_queue = rq.Queue('app-tasks', connection=app.redis)
+    # `app.task_queues` holds all the queues, see `app.queues`.
+    from app.queues import make_queues
+    app.task_queues = make_queues(app)
+    app.task_queue = app.task_queues[app.config['TASK_DEFAULT_QUEUE']]
+
+    # cache the bearer tokens in order to skip the database lookup in `verify_token`.
+    from app.cache import (CountCache, InflightTasks, ResourceVersions, ResponseCache,
+                           TokenCache)
+    app.token_cache = TokenCache(app)
+    # cache the total counts of the paginated collections.
+    app.count_cache = CountCache(app)
+    # versions of the resources for the ETags, and the cached responses.
+    app.resource_versions = ResourceVersions(app)
+    app.response_cache = ResponseCache(app)
+    # issues and verifies the tokens of `TOKEN_MODE = 'signed'`.
+    from app.signed_tokens import SignedTokens
+    app.signed_tokens = SignedTokens(app)
+    # the tasks in flight, so that `launch_task` does not start them twice.
+    app.inflight_tasks = InflightTasks(app)
+    # fan the task progress out to the connected clients.
+    from app.events import TaskEvents
+    app.task_events = TaskEvents(app)
+    # hash the passwords outside of the request threads.
+    from app.passwords import PasswordHasher
+    app.password_hasher = PasswordHasher(app)
+    # encode the API responses with the fastest json backend available.
+    from app.json_provider import make_json_provider
+    app.json_provider = make_json_provider(app)
+
+    # latency, SQL and redis numbers of the requests, at `/metrics`.
+    if app.config['METRICS_ENABLED']:
+        from app.metrics import Metrics
+        app.metrics = Metrics(app)
 
     # register blueprint
     from app.main import bp as main_bp
@@ -44,23 +102,13 @@ def create_app(config=DevelopmentConfig):
     app.register_blueprint(api_bp, url_prefix='/api')
 
     if not app.debug:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        '''The `RotatingFileHandler` class is nice because it rotates the logs,
-            ensuring that the log files do not grow too large
-            when the application runs for a long time. 
+        '''The records are written by a background thread of every process, to
+            stdout with `LOG_TO_STDOUT` or to a log file per process, so the
+            request threads never wait for the disk and the workers never rotate
+            each other's files. See `app.log`.
         '''
-        file_handler = RotatingFileHandler('logs/application.log', maxBytes=10240,
-                                       backupCount=10)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-        '''logging categories, they are DEBUG, INFO, WARNING, ERROR and CRITICAL
-            in increasing order of severity.
-        '''
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-
-        app.logger.setLevel(logging.INFO)
+        from app.log import init_logging
+        init_logging(app)
         app.logger.info('Application startup')
 
     return app
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('api', __name__)
 
-from app.api import user, tokens
\ No newline at end of file
+from app.api import user, tokens, followers, tasks
\ No newline at end of file
@@ -1,6 +1,8 @@
+from flask import abort, current_app
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 from app.models import User
 from app.api.errors import error_response
+from app.passwords import PasswordPoolBusy
 
 basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
@@ -20,7 +22,16 @@ def verify_password(username, password):
         User
     """
     user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    if user is None:
+        return None
+    try:
+        valid = user.check_password(password)
+    except PasswordPoolBusy:
+        # shed the load rather than queueing the login.
+        response = error_response(503, 'too many concurrent logins, please retry.')
+        response.headers['Retry-After'] = '1'
+        abort(response)
+    if valid:
         return user
 
 
@@ -32,11 +43,32 @@ def basic_auth_error(status):
 @token_auth.verify_token
 def verify_token(token):
     """called before reqeust the route decorated with @token_auth.login_required
+        The token is resolved through `app.token_cache` first, the database is
+        only queried on a miss. Signed tokens are verified without any lookup.
+        Malformed tokens and tokens that were rejected recently never reach the
+        database.
 
     Args:
         token (string): From request
     """
-    return User.check_token(token) if token else None
+    if not token or not User.is_well_formed_token(token):
+        return None
+    if current_app.config['TOKEN_MODE'] == 'signed':
+        # no lookup at all, only the signature and the revocations are checked.
+        user_id = current_app.signed_tokens.verify(token)
+        return User.from_token_snapshot({'id': user_id}) if user_id is not None else None
+    cache = current_app.token_cache
+    data = cache.get(token)
+    if data is False:
+        return None
+    if data is not None:
+        return User.from_token_snapshot(data)
+    user = User.check_token(token)
+    if user is None:
+        cache.reject(token)
+    else:
+        cache.set(token, user.to_token_snapshot())
+    return user
 
 
 @token_auth.error_handler
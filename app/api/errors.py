@@ -1,7 +1,8 @@
 
-from flask import jsonify
 from werkzeug.http import HTTP_STATUS_CODES
 
+from app.json_provider import jsonify
+
 
 def error_response(status_code, message=None):
     payload = {
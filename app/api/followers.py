@@ -0,0 +1,214 @@
+from flask import current_app, request
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request, error_response
+from app.api.user import make_etag, not_modified, users_changed
+from app.json_provider import jsonify
+from app.models import MAX_ID, User
+
+
+@bp.route('/users/<int:id>/follow', methods=['POST'])
+@token_auth.login_required
+def follow(id):
+    """The current user follows the user.
+
+    Args:
+        id (int): the user to follow.
+    """
+    user = User.query.get_or_404(id)
+    current_user = token_auth.current_user()
+    if user.id == current_user.id:
+        return bad_request('you cannot follow yourself')
+    try:
+        changed = current_user.follow(user)
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request inserted the same row first.
+        db.session.rollback()
+        changed = False
+    if changed:
+        users_changed(current_user.id, user.id)
+    return '', 204
+
+
+@bp.route('/users/<int:id>/follow', methods=['DELETE'])
+@token_auth.login_required
+def unfollow(id):
+    """The current user stops following the user.
+
+    Args:
+        id (int): the user to unfollow.
+    """
+    user = User.query.get_or_404(id)
+    current_user = token_auth.current_user()
+    ids = (current_user.id, user.id)
+    if current_user.unfollow(user):
+        db.session.commit()
+        users_changed(*ids)
+    return '', 204
+
+
+def _follow_collection(id, relationship, total, endpoint):
+    """a page of `followers` or `followed`, with the same arguments as
+        `GET /api/users`. The total comes from the denormalized counter
+        instead of a `COUNT(*)`.
+    """
+    etag = make_etag('users')
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    user = User.query.get_or_404(id)
+    page = request.args.get('page', 1, type=int)
+    per_page = max(min(request.args.get('per_page', 10, type=int), 100), 1)
+    try:
+        data = User.to_collection_dict(getattr(user, relationship), page, per_page,
+                                       endpoint, cursor=request.args.get('cursor'),
+                                       count=request.args.get('count'),
+                                       fields=request.args.get('fields'),
+                                       total=getattr(user, total), id=id)
+    except ValueError as e:
+        return bad_request(str(e))
+    response = jsonify(data)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+@bp.route('/users/<int:id>/followers', methods=['GET'])
+@token_auth.login_required
+def get_followers(id):
+    """Return the users following the user.
+
+    Args:
+        id (int): the user id.
+    """
+    return _follow_collection(id, 'followers', 'follower_count', 'api.get_followers')
+
+
+@bp.route('/users/<int:id>/followed', methods=['GET'])
+@token_auth.login_required
+def get_followed(id):
+    """Return the users the user follows.
+
+    Args:
+        id (int): the user id.
+    """
+    return _follow_collection(id, 'followed', 'followed_count', 'api.get_followed')
+
+
+def _parse_ids(ids):
+    """the user ids of a batch request, from a json list or a comma separated
+        string.
+
+    Raises:
+        ValueError: the ids are invalid or too many.
+
+    Returns:
+        list: the ids.
+    """
+    if isinstance(ids, str):
+        ids = [id for id in ids.split(',') if id.strip()]
+    if not isinstance(ids, list):
+        raise ValueError('ids must be a list of integers')
+    try:
+        ids = [int(id) for id in ids]
+    except (TypeError, ValueError):
+        raise ValueError('ids must be a list of integers')
+    if any(not 0 < id <= MAX_ID for id in ids):
+        raise ValueError('ids must be between 1 and {}'.format(MAX_ID))
+    limit = current_app.config['API_FOLLOW_BATCH_LIMIT']
+    if len(ids) > limit:
+        raise ValueError('at most {} ids can be sent at once'.format(limit))
+    return ids
+
+
+@bp.route('/follows', methods=['GET'])
+@token_auth.login_required
+def get_follows():
+    """Which of the `ids` (comma separated) the current user follows, with a
+        single IN probe of the followers table.
+    """
+    try:
+        ids = _parse_ids(request.args.get('ids', ''))
+    except ValueError as e:
+        return bad_request(str(e))
+    following = token_auth.current_user().following_among(ids) if ids else set()
+    return jsonify({
+        'following': [id for id in ids if id in following],
+        'not_following': [id for id in ids if id not in following]
+    })
+
+
+@bp.route('/follows', methods=['POST'])
+@token_auth.login_required
+def follow_many():
+    """The current user follows all the users of `{"ids": [...]}`, with a single
+        `INSERT ... SELECT` that skips the ones already followed.
+    """
+    try:
+        ids = _parse_ids((request.get_json(silent=True) or {}).get('ids'))
+    except ValueError as e:
+        return bad_request(str(e))
+    current_user = token_auth.current_user()
+    current_user_id = current_user.id
+    try:
+        changed = current_user.follow_many(ids)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return error_response(409, 'conflict with a concurrent request, please retry.')
+    if changed:
+        users_changed(current_user_id, *changed)
+    return jsonify({'requested': len(ids), 'followed': sorted(changed)})
+
+
+@bp.route('/follows', methods=['DELETE'])
+@token_auth.login_required
+def unfollow_many():
+    """The current user stops following all the users of `{"ids": [...]}`,
+        with a single `DELETE`.
+    """
+    try:
+        ids = _parse_ids((request.get_json(silent=True) or {}).get('ids'))
+    except ValueError as e:
+        return bad_request(str(e))
+    current_user = token_auth.current_user()
+    current_user_id = current_user.id
+    changed = current_user.unfollow_many(ids)
+    db.session.commit()
+    if changed:
+        users_changed(current_user_id, *changed)
+    return jsonify({'requested': len(ids), 'unfollowed': sorted(changed)})
+
+
+@bp.route('/users/<int:id>/followers/mutual/<int:other_id>', methods=['GET'])
+@token_auth.login_required
+def get_mutual_followers(id, other_id):
+    """Return the users following both users, with the same arguments as
+        `GET /api/users`.
+
+    Args:
+        id (int): a user id.
+        other_id (int): another user id.
+    """
+    etag = make_etag('users')
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    page = request.args.get('page', 1, type=int)
+    per_page = max(min(request.args.get('per_page', 10, type=int), 100), 1)
+    try:
+        data = User.to_collection_dict(User.mutual_followers(id, other_id), page, per_page,
+                                       'api.get_mutual_followers',
+                                       cursor=request.args.get('cursor'),
+                                       count=request.args.get('count'),
+                                       fields=request.args.get('fields'),
+                                       id=id, other_id=other_id)
+    except ValueError as e:
+        return bad_request(str(e))
+    response = jsonify(data)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
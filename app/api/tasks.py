@@ -0,0 +1,100 @@
+import queue
+import time
+
+from flask import current_app, request
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request
+from app.json_provider import jsonify
+from app.models import Task
+
+
+@bp.route('/tasks', methods=['GET'])
+@token_auth.login_required
+def get_tasks():
+    """Return the tasks of the current user with their progress.
+        The tasks are loaded with one query and their rq jobs with one
+        pipelined redis round trip, whatever the number of tasks.
+
+        `ids` (comma separated) restricts the result to these tasks, and
+        `complete=0` to the tasks still in progress.
+    """
+    query = Task.query.filter_by(user_id=token_auth.current_user().id)
+    ids = request.args.get('ids')
+    if ids is not None:
+        ids = [id.strip() for id in ids.split(',') if id.strip()]
+        limit = current_app.config['API_BATCH_LIMIT']
+        if len(ids) > limit:
+            return bad_request('at most {} ids can be requested at once'.format(limit))
+        query = query.filter(Task.id.in_(ids))
+    complete = request.args.get('complete')
+    if complete is not None:
+        if complete not in ('0', '1'):
+            return bad_request('complete must be 0 or 1')
+        query = query.filter(Task.complete == (complete == '1'))
+    tasks = query.all()
+    if ids is not None:
+        # the requested order, the tasks of the other users are left out.
+        found = {task.id: task for task in tasks}
+        tasks = [found[id] for id in dict.fromkeys(ids) if id in found]
+    return jsonify({
+        'items': _task_items(tasks),
+        '_meta': {'total_items': len(tasks)}
+    })
+
+
+def _task_items(tasks):
+    jobs = Task.get_rq_jobs(tasks)
+    return [task.to_dict(job) for task, job in zip(tasks, jobs)]
+
+
+@bp.route('/tasks/stream', methods=['GET'])
+@token_auth.login_required
+def stream_tasks():
+    """Push the progress of the tasks of the current user as Server-Sent Events.
+        The stream starts with a `tasks` event holding the tasks in progress,
+        followed by a `progress` event for every update published by
+        `app.tasks._set_task_progress`.
+
+        NOTE: the connection stays open for up to `SSE_MAX_DURATION` seconds,
+        run gunicorn with an async worker class (`-k gevent`) so that idle
+        clients do not hold a worker each. The database session is released
+        before the stream starts.
+    """
+    user_id = token_auth.current_user().id
+    events = current_app.task_events
+    # subscribe before reading the snapshot, so that no update is missed.
+    subscription = events.subscribe(user_id)
+    try:
+        tasks = Task.query.filter_by(user_id=user_id, complete=False).all()
+        snapshot = current_app.json_provider.dumps(_task_items(tasks), compact=True)
+    except Exception:
+        events.unsubscribe(user_id, subscription)
+        raise
+    heartbeat = current_app.config['SSE_HEARTBEAT']
+    max_duration = current_app.config['SSE_MAX_DURATION']
+    retry = current_app.config['SSE_RETRY']
+
+    def generate():
+        try:
+            yield 'retry: {}\n\n'.format(retry).encode('utf-8')
+            yield b'event: tasks\ndata: ' + snapshot.rstrip(b'\n') + b'\n\n'
+            deadline = time.time() + max_duration
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    data = subscription.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield b': keep-alive\n\n'
+                    continue
+                yield b'event: progress\ndata: ' + data + b'\n\n'
+        finally:
+            events.unsubscribe(user_id, subscription)
+
+    response = current_app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # NOTE: tells nginx not to buffer the events.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,35 +1,238 @@
-from flask.helpers import url_for
-from flask import abort
+import hashlib
+import json
+import zlib
+
+from flask import abort, stream_with_context
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from app.api import bp
 from app.api.errors import bad_request
 from app import db
 
-from flask import jsonify, request
-from app.models import User
+from flask import current_app, request
+from app.models import MAX_ID, User
 
 from app.api.auth import token_auth
+from app.links import link_for
+from app.json_provider import jsonify
+from app.passwords import PasswordPoolBusy
+
+
+def make_etag(resource):
+    """builds a strong ETag for the current request from the version of the
+        resource, so that it can be checked before running any query.
+        The reads of the request go to the primary while the replicas may not
+        have the last write of the resource yet, see `ResourceVersions`.
+
+    Args:
+        resource (string): the versioned resource, see `app.resource_versions`.
+
+    Returns:
+        string: the ETag, None when the version is not available.
+    """
+    version, recent = current_app.resource_versions.check(resource)
+    if recent:
+        # NOTE: a stale body from a replica would be served, and cached, with
+        # the new ETag.
+        db.primary_reads()
+    if version is None:
+        return None
+    return hashlib.sha1('{}:{}:{}'.format(resource, version, request.full_path)
+                        .encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    """
+    Returns:
+        Response: a 304 response if the client already has this ETag, else None.
+    """
+    if etag is None or not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def users_changed(*ids):
+    """to be called after a write to the users, it invalidates the ETags, the
+        cached responses and the cached counts.
+
+    Args:
+        ids (int): the users that were created or modified.
+    """
+    current_app.resource_versions.bump('users', *['user:{}'.format(id) for id in ids])
+    current_app.count_cache.invalidate(User.__tablename__)
 
 
 @bp.route('/users/<int:id>', methods=['GET'])
 @token_auth.login_required
 def get_user(id):
     """Return a user.
+        Only the columns needed by the `fields` argument are loaded.
+        It answers 304 to a matching `If-None-Match` without querying the user.
 
     Args:
         id (int): the user id.
     """
-    return jsonify(User.query.get_or_404(id).to_dict())
+    etag = make_etag('user:{}'.format(id))
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    try:
+        fields = User.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return bad_request(str(e))
+    row = User.query.with_entities(*User.columns_for(fields)) \
+        .filter(User.id == id).first()
+    if row is None:
+        abort(404)
+    response = jsonify(User.serialize(row, fields))
+    if etag is not None:
+        response.set_etag(etag)
+    return response
 
 
 @bp.route('/users', methods=['GET'])
 @token_auth.login_required
 def get_users():
     """Return the collection of all users.
+        Pass `cursor` (empty for the first page) instead of `page` to use the
+        keyset pagination, then follow `_links.next`.
+        Pass `count=none` to skip the totals, or `count=exact` to bypass the
+        cached ones.
+        Pass `fields` (e.g. `fields=id,username`) to select the fields of the items.
+        Pass `ids` (e.g. `ids=3,1,2`) to look up several users at once instead
+        of paginating, see `get_user_batch`.
+        The pages carry an ETag and may be served from `app.response_cache`.
     """
+    etag = make_etag('users')
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    body = current_app.response_cache.get(etag) if etag is not None else None
+    if body is not None:
+        response = current_app.response_class(
+            body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+        response.set_etag(etag)
+        return response
     page = request.args.get('page', 1, type=int)
-    per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(User.query, page, per_page, 'api.get_users')
-    return jsonify(data)
+    per_page = max(min(request.args.get('per_page', 10, type=int), 100), 1)
+    cursor = request.args.get('cursor')
+    count = request.args.get('count')
+    fields = request.args.get('fields')
+    ids = request.args.get('ids')
+    try:
+        if ids is not None:
+            data = get_user_batch(ids, fields)
+        else:
+            data = User.to_collection_dict(User.query, page, per_page, 'api.get_users',
+                                           cursor=cursor, count=count, fields=fields)
+    except ValueError as e:
+        return bad_request(str(e))
+    response = jsonify(data)
+    if etag is not None:
+        response.set_etag(etag)
+        current_app.response_cache.set(etag, response.get_data())
+    return response
+
+
+def get_user_batch(ids, fields=None):
+    """Resolve several users with a single `WHERE id IN (...)` query.
+
+    Args:
+        ids (string): comma separated user ids, at most `API_BATCH_LIMIT` of them.
+        fields (string): comma separated sparse fieldset.
+
+    Raises:
+        ValueError: the ids or the fields are invalid.
+
+    Returns:
+        dict: the users in the requested order, a missing user is reported
+            inline as `{'id': id, 'error': 'Not Found'}`.
+    """
+    try:
+        ids = [int(id) for id in ids.split(',') if id.strip()]
+    except ValueError:
+        raise ValueError('ids must be comma separated integers')
+    # NOTE: the driver can not even bind an id beyond the range of the column.
+    invalid = [id for id in ids if not 0 < id <= MAX_ID]
+    if invalid:
+        raise ValueError('invalid ids: {}'.format(', '.join(str(id) for id in invalid[:10])))
+    limit = current_app.config['API_BATCH_LIMIT']
+    if len(ids) > limit:
+        raise ValueError('at most {} ids can be requested at once'.format(limit))
+    selected = User.parse_fields(fields)
+    serialize = User.serializer(selected)
+    rows = User.query.with_entities(*User.columns_for(selected)) \
+        .filter(User.id.in_(set(ids))).all() if ids else []
+    found = {row.id: row for row in rows}
+    items, missing = [], []
+    for id in ids:
+        if id in found:
+            items.append(serialize(found[id]))
+        else:
+            items.append({'id': id, 'error': 'Not Found'})
+            missing.append(id)
+    return {
+        'items': items,
+        '_meta': {
+            'requested': len(ids),
+            'found': len(ids) - len(missing),
+            'missing': missing
+        }
+    }
+
+
+@bp.route('/users/export', methods=['GET'])
+@token_auth.login_required
+def export_users():
+    """Stream all the users as newline delimited json, one user per line,
+        in id order. The rows are fetched `API_EXPORT_BATCH_SIZE` at a time
+        with a server side cursor (where the database supports one), so the
+        memory stays flat whatever the size of the table.
+        Pass `since_id` to resume after the last id received, and `fields`
+        to select the fields. The output is gzipped on the fly when the
+        client accepts it.
+    """
+    try:
+        fields = User.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return bad_request(str(e))
+    since_id = request.args.get('since_id', 0, type=int)
+    # NOTE: checked here, the driver would only fail once the 200 is sent.
+    if not 0 <= since_id <= MAX_ID:
+        return bad_request('since_id must be between 0 and {}'.format(MAX_ID))
+    gzip = request.accept_encodings['gzip'] > 0
+    batch_size = current_app.config['API_EXPORT_BATCH_SIZE']
+    query = User.query.with_entities(*User.columns_for(fields)) \
+        .filter(User.id > since_id).order_by(User.id) \
+        .execution_options(stream_results=True).yield_per(batch_size)
+
+    def generate():
+        serialize = User.serializer(fields)
+        dumps = current_app.json_provider.dumps
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip else None
+        lines = []
+        for i, row in enumerate(query, 1):
+            lines.append(dumps(serialize(row), compact=True))
+            if i % batch_size == 0:
+                chunk = b''.join(lines)
+                lines = []
+                chunk = compressor.compress(chunk) if gzip else chunk
+                if chunk:
+                    yield chunk
+        chunk = b''.join(lines)
+        if gzip:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    response = current_app.response_class(stream_with_context(generate()),
+                                          mimetype='application/x-ndjson')
+    response.vary.add('Accept-Encoding')
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 
 @bp.route('/users', methods=['POST'])
@@ -45,9 +248,161 @@ def create_user():
     user.from_dict(data, new_user=True)
     db.session.add(user)
     db.session.commit()
+    users_changed(user.id)
     response = jsonify(user.to_dict())
     response.status_code = 201
-    response.headers['Location'] = url_for('api.get_user', id=user.id)
+    response.headers['Location'] = link_for('api.get_user', id=user.id)
+    return response
+
+
+def _read_bulk_body():
+    """the users of a bulk request, from a json array or from newline
+        delimited json (`Content-Type: application/x-ndjson`).
+
+    Raises:
+        ValueError: the body can not be parsed.
+
+    Returns:
+        list: the raw rows.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        return [json.loads(line) for line in request.get_data(as_text=True).splitlines()
+                if line.strip()]
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError('expected a json array of users')
+    return rows
+
+
+def _create_user_chunk(chunk, results):
+    """checks, hashes and inserts a chunk of valid rows, the outcome of every
+        row is written to `results`.
+
+    Args:
+        chunk (list): (index, row) tuples.
+        results (list): the per-row results of the whole request.
+
+    Returns:
+        list: the ids of the created users.
+    """
+    usernames = [row['username'] for _, row in chunk]
+    emails = [row['email'] for _, row in chunk if row.get('email')]
+    taken_usernames, taken_emails = set(), set()
+    for username, email in User.query.with_entities(User.username, User.email) \
+            .filter(or_(User.username.in_(usernames), User.email.in_(emails))):
+        taken_usernames.add(username)
+        taken_emails.add(email)
+    rows = []
+    for index, row in chunk:
+        if row['username'] in taken_usernames or \
+                (row.get('email') and row['email'] in taken_emails):
+            results[index] = {'index': index, 'status': 400,
+                              'error': 'username or email already in use'}
+        else:
+            rows.append((index, row))
+    if not rows:
+        return []
+    hashes = current_app.password_hasher.generate_many([row['password'] for _, row in rows])
+    mappings = [{
+        'username': row['username'],
+        'email': row.get('email'),
+        'password_hash': password_hash
+    } for (_, row), password_hash in zip(rows, hashes)]
+    try:
+        db.session.bulk_insert_mappings(User, mappings)
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent registration took some of the names, the rows are
+        # inserted one by one so that only those fail.
+        db.session.rollback()
+        inserted = []
+        for (index, row), mapping in zip(rows, mappings):
+            try:
+                db.session.bulk_insert_mappings(User, [mapping])
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                results[index] = {'index': index, 'status': 409,
+                                  'error': 'conflict with a concurrent registration'}
+            else:
+                inserted.append((index, row))
+        rows = inserted
+        if not rows:
+            return []
+    ids = dict(User.query.with_entities(User.username, User.id)
+               .filter(User.username.in_([row['username'] for _, row in rows])))
+    for index, row in rows:
+        id = ids[row['username']]
+        results[index] = {'index': index, 'status': 201, 'id': id,
+                          '_links': {'self': link_for('api.get_user', id=id)}}
+    return list(ids.values())
+
+
+@bp.route('/users/bulk', methods=['POST'])
+@token_auth.login_required
+def create_users():
+    """Register many user accounts at once, from a json array or from newline
+        delimited json. The rows are processed `API_BULK_CHUNK_SIZE` at a time:
+        one query checks the usernames and emails of the chunk, the passwords
+        are hashed on the password pool and the rows are inserted in a single
+        executemany (one by one if a concurrent registration conflicts).
+
+    Returns:
+        the result of every row, in the order of the request. When the
+            password pool is busy the rows left are answered with a 503 and
+            the response carries `Retry-After`.
+    """
+    try:
+        data = _read_bulk_body()
+    except ValueError as e:
+        return bad_request(str(e))
+    limit = current_app.config['API_BULK_LIMIT']
+    if len(data) > limit:
+        return bad_request('at most {} users can be created at once'.format(limit))
+    results = [None] * len(data)
+    valid, seen_usernames, seen_emails = [], set(), set()
+    for index, row in enumerate(data):
+        if not isinstance(row, dict) or not row.get('username') or not row.get('password'):
+            results[index] = {'index': index, 'status': 400,
+                              'error': 'must include username and password.'}
+        elif not isinstance(row['username'], str) or not isinstance(row['password'], str) \
+                or not isinstance(row.get('email', ''), (str, type(None))):
+            results[index] = {'index': index, 'status': 400,
+                              'error': 'username, password and email must be strings.'}
+        elif row['username'] in seen_usernames or \
+                (row.get('email') and row['email'] in seen_emails):
+            results[index] = {'index': index, 'status': 400,
+                              'error': 'duplicate username or email in the request'}
+        else:
+            seen_usernames.add(row['username'])
+            if row.get('email'):
+                seen_emails.add(row['email'])
+            valid.append((index, row))
+    chunk_size = current_app.config['API_BULK_CHUNK_SIZE']
+    created, busy = [], False
+    try:
+        for start in range(0, len(valid), chunk_size):
+            created.extend(_create_user_chunk(valid[start:start + chunk_size], results))
+    except PasswordPoolBusy:
+        # NOTE: the previous chunks are committed, their results are kept.
+        busy = True
+        for index, _ in valid:
+            if results[index] is None:
+                results[index] = {'index': index, 'status': 503,
+                                  'error': 'the password pool is busy, please retry.'}
+    finally:
+        if created:
+            users_changed()
+    response = jsonify({
+        'items': results,
+        '_meta': {
+            'requested': len(data),
+            'created': len(created),
+            'failed': len(data) - len(created)
+        }
+    })
+    if busy:
+        response.headers['Retry-After'] = '1'
     return response
 
 
@@ -69,4 +424,5 @@ def update_user(id):
 
     user.from_dict(data, new_user=False)
     db.session.commit()
+    users_changed(user.id)
     return jsonify(user.to_dict())
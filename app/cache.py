@@ -0,0 +1,504 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+import redis
+
+
+class LocalCache(object):
+    """A bounded in-process LRU cache with a TTL per entry.
+        It is shared by all the threads of a worker process, so every access
+        goes through a lock.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or has expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenCache(object):
+    """Resolves bearer tokens to a user snapshot without querying the database.
+        The first tier is a `LocalCache` in every worker process, the second one
+        is the shared redis (`app.redis`). Entries never outlive the
+        `token_expiration` of the user they were built from.
+
+        Tokens rejected by `User.check_token` are remembered as well, for
+        `TOKEN_CACHE_NEGATIVE_TTL` seconds, so that a flood of bad tokens does
+        not reach the database. They live in their own local LRU so that they
+        can not evict the valid ones.
+
+        `invalidate()` replaces the redis entry with a rejection, so a request
+        which read the old row before the commit can not cache it again, and
+        records the key in the sorted set `token:invalidated`. Every process
+        checks the counter `token:invalidated:version` at most every
+        `TOKEN_CACHE_SYNC_INTERVAL` seconds and then drops those keys from its
+        local tier, so an invalidated token is served for that long at most.
+    """
+    invalidated_key = 'token:invalidated'
+    version_key = 'token:invalidated:version'
+
+    def __init__(self, app=None):
+        self.local = LocalCache()
+        self.rejected = LocalCache()
+        self.redis = None
+        self.ttl = 300
+        self.local_ttl = 10
+        self.negative_ttl = 30
+        self.sync_interval = 1
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0,
+                       'negative_hits': 0}
+        self._stats_lock = threading.Lock()
+        self._version = None
+        self._next_sync = 0
+        self._sync_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.local = LocalCache(app.config['TOKEN_CACHE_SIZE'])
+        self.rejected = LocalCache(app.config['TOKEN_CACHE_SIZE'])
+        self.redis = app.redis
+        self.ttl = app.config['TOKEN_CACHE_TTL']
+        self.local_ttl = app.config['TOKEN_CACHE_LOCAL_TTL']
+        self.negative_ttl = app.config['TOKEN_CACHE_NEGATIVE_TTL']
+        self.sync_interval = app.config['TOKEN_CACHE_SYNC_INTERVAL']
+
+    @staticmethod
+    def _key(token):
+        # never use the raw token as a redis key.
+        return 'token:' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    @property
+    def stats(self):
+        """Hit and miss counters of the current process.
+
+        Returns:
+            dict: `local_hits`, `redis_hits`, `negative_hits` and `misses`.
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def get(self, token):
+        """Look the token up in both tiers.
+
+        Args:
+            token (string): the bearer token from the request.
+
+        Returns:
+            dict: the user snapshot stored by `set()`, False if the token is
+                known to be invalid, or None on a miss.
+        """
+        key = self._key(token)
+        if self.rejected.get(key) is not None:
+            self._count('negative_hits')
+            return False
+        if time.time() >= self._next_sync:
+            self._sync()
+        data = self.local.get(key)
+        if data is not None and data['expires_at'] > time.time():
+            self._count('local_hits')
+            return data
+        data = None
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+            except redis.exceptions.RedisError:
+                raw = None
+            if raw is not None:
+                data = json.loads(raw)
+        if data is False:
+            self._count('negative_hits')
+            self.rejected.set(key, True, self.negative_ttl)
+            return False
+        if data is None or data['expires_at'] <= time.time():
+            self._count('misses')
+            return None
+        self._count('redis_hits')
+        self.local.set(key, data, min(self.local_ttl,
+                                      data['expires_at'] - time.time()))
+        return data
+
+    def set(self, token, data):
+        """Store a user snapshot for the token in both tiers.
+
+        Args:
+            token (string): the bearer token.
+            data (dict): the snapshot, it must contain `expires_at`
+                (a unix timestamp) which bounds the lifetime of the entry.
+        """
+        key = self._key(token)
+        remaining = data['expires_at'] - time.time()
+        self.local.set(key, data, min(self.local_ttl, remaining))
+        ttl = int(min(self.ttl, remaining))
+        if self.redis is not None and ttl > 0:
+            try:
+                # NOTE: never overwrites the rejection left by `invalidate()`.
+                self.redis.set(key, json.dumps(data), ex=ttl, nx=True)
+            except redis.exceptions.RedisError:
+                pass
+
+    def reject(self, token):
+        """Remember for a short while that the token is invalid.
+
+        Args:
+            token (string): a token rejected by `User.check_token`.
+        """
+        key = self._key(token)
+        self.rejected.set(key, True, self.negative_ttl)
+        if self.redis is not None and self.negative_ttl > 0:
+            try:
+                self.redis.set(key, json.dumps(False), ex=self.negative_ttl)
+            except redis.exceptions.RedisError:
+                pass
+
+    def invalidate(self, token):
+        """Reject the token in every process, once it was revoked or rotated.
+            Call it after the commit, see `User.revoke_token`.
+
+        Args:
+            token (string): the token which is no longer valid.
+        """
+        if not token:
+            return
+        key = self._key(token)
+        self.local.delete(key)
+        self.rejected.set(key, True, self.negative_ttl)
+        if self.redis is None:
+            return
+        now = time.time()
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(key, json.dumps(False), ex=max(self.negative_ttl, 1))
+            pipe.zadd(self.invalidated_key, {key: now})
+            # older entries have expired from every local tier already.
+            pipe.zremrangebyscore(self.invalidated_key, 0, now - self.local_ttl - 1)
+            pipe.incr(self.version_key)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def _sync(self):
+        # only one thread syncs, the others keep using the local tier.
+        if self.redis is None or not self._sync_lock.acquire(False):
+            return
+        try:
+            self._next_sync = time.time() + self.sync_interval
+            try:
+                version = self.redis.get(self.version_key)
+                if version == self._version:
+                    return
+                keys = self.redis.zrange(self.invalidated_key, 0, -1)
+            except redis.exceptions.RedisError:
+                return
+            for key in keys:
+                self.local.delete(key.decode('utf-8'))
+            self._version = version
+        finally:
+            self._sync_lock.release()
+
+
+class CountCache(object):
+    """Caches the `COUNT(*)` of the paginated collections in redis.
+        The counts of a table are the fields of one redis hash, keyed by the
+        shape of the query (its SQL and parameters). Writing to the table only
+        needs to drop that hash with `invalidate()`.
+    """
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.ttl = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.redis = app.redis
+        self.ttl = app.config['API_COUNT_CACHE_TTL']
+
+    @staticmethod
+    def _key(table):
+        return 'count:' + table
+
+    @staticmethod
+    def _shape(query):
+        statement = query.statement.compile()
+        params = sorted((k, repr(v)) for k, v in statement.params.items())
+        return hashlib.sha1(repr((str(statement), params)).encode('utf-8')).hexdigest()
+
+    def count(self, table, query):
+        """Count the rows of the query, from the cache when possible.
+
+        Args:
+            table (string): the table the query is invalidated with.
+            query (object): a Flask-SQLAlchemy query object.
+
+        Returns:
+            tuple: the count, and whether it came from the cache.
+        """
+        key, shape = self._key(table), self._shape(query)
+        if self.redis is not None:
+            try:
+                raw = self.redis.hget(key, shape)
+            except redis.exceptions.RedisError:
+                raw = None
+            if raw is not None:
+                total, counted_at = raw.decode('utf-8').split(':')
+                if float(counted_at) + self.ttl > time.time():
+                    return int(total), True
+        total = query.order_by(None).count()
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.hset(key, shape, '{}:{}'.format(total, time.time()))
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+            except redis.exceptions.RedisError:
+                pass
+        return total, False
+
+    def invalidate(self, table):
+        if self.redis is None:
+            return
+        try:
+            self.redis.delete(self._key(table))
+        except redis.exceptions.RedisError:
+            pass
+
+
+class ResourceVersions(object):
+    """Version counters of the API resources, kept in redis and bumped on
+        every write, so that an ETag can be checked before any query runs.
+        A missing counter starts from the current time in milliseconds rather
+        than from 0, an ETag issued before redis was flushed can then not
+        match again.
+
+        The counters expire `API_VERSION_TTL` seconds after they were created
+        or last bumped, since `get()` creates one for every id requested, the
+        ids which do not exist included.
+
+        With read replicas, a bump is also remembered for
+        `SQLALCHEMY_REPLICA_LAG` seconds: a replica may not have the write
+        yet, and a stale body must not be served (nor cached) under the new
+        version, `check()` tells to read from the primary then.
+    """
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.ttl = 86400
+        self.lag = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.redis = app.redis
+        self.ttl = app.config['API_VERSION_TTL']
+        if app.config['SQLALCHEMY_REPLICA_URIS']:
+            self.lag = app.config['SQLALCHEMY_REPLICA_LAG']
+
+    @staticmethod
+    def _seed():
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _key(name):
+        return 'version:' + name
+
+    @staticmethod
+    def _bumped_key(name):
+        return 'version:' + name + ':bumped'
+
+    def get(self, name):
+        """
+        Args:
+            name (string): the resource, such as 'user:1' or 'users'.
+
+        Returns:
+            int: the current version, None when redis is not available.
+        """
+        return self.check(name)[0]
+
+    def check(self, name):
+        """the current version, in the same round trip as the recent bumps.
+
+        Args:
+            name (string): the resource, such as 'user:1' or 'users'.
+
+        Returns:
+            tuple: the current version (None when redis is not available), and
+                whether it was bumped within the last `SQLALCHEMY_REPLICA_LAG`
+                seconds.
+        """
+        if self.redis is None:
+            return None, False
+        key = self._key(name)
+        try:
+            if self.lag > 0:
+                version, bumped = self.redis.mget(key, self._bumped_key(name))
+            else:
+                version, bumped = self.redis.get(key), None
+            if version is None:
+                self.redis.set(key, self._seed(), nx=True, ex=self.ttl)
+                version = self.redis.get(key)
+        except redis.exceptions.RedisError:
+            return None, False
+        return int(version), bumped is not None
+
+    def bump(self, *names):
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            for name in names:
+                key = self._key(name)
+                # NOTE: an expired counter starts again from the time too.
+                pipe.set(key, self._seed(), nx=True)
+                pipe.incr(key)
+                pipe.expire(key, self.ttl)
+                if self.lag > 0:
+                    pipe.set(self._bumped_key(name), 1, px=int(self.lag * 1000))
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+
+class ResponseCache(object):
+    """Caches rendered response bodies in redis for `API_RESPONSE_CACHE_TTL`
+        seconds, 0 disables it. The keys are expected to include a resource
+        version, so the writes never need to delete anything.
+    """
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.redis = app.redis
+        self.ttl = app.config['API_RESPONSE_CACHE_TTL']
+
+    def get(self, key):
+        if self.redis is None or self.ttl <= 0:
+            return None
+        try:
+            return self.redis.get('response:' + key)
+        except redis.exceptions.RedisError:
+            return None
+
+    def set(self, key, body):
+        if self.redis is None or self.ttl <= 0:
+            return
+        try:
+            self.redis.set('response:' + key, body, ex=self.ttl)
+        except redis.exceptions.RedisError:
+            pass
+
+
+class InflightTasks(object):
+    """The tasks in flight, one redis key per user and task name holding the
+        rq job id. `User.launch_task` claims the key before enqueueing, so a
+        second launch of the same task is refused without reading the database.
+        The key is released by the rq callbacks of the job, whether it succeeds,
+        fails or is stopped. A work horse which is killed keeps it until
+        `TASK_INFLIGHT_TTL` seconds have passed.
+    """
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.ttl = 3600
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.redis = app.redis
+        self.ttl = app.config['TASK_INFLIGHT_TTL']
+
+    @staticmethod
+    def _key(user_id, name):
+        return 'task:inflight:{}:{}'.format(user_id, name)
+
+    def acquire(self, user_id, name, job_id):
+        """Claim the task for the job, atomically.
+
+        Args:
+            user_id (int): the user launching the task.
+            name (string): the task name.
+            job_id (string): the id of the job about to be enqueued.
+
+        Returns:
+            string: the id of the job already in flight, None when the claim
+                succeeded or redis is not available.
+        """
+        if self.redis is None:
+            return None
+        key = self._key(user_id, name)
+        try:
+            # NOTE: MULTI makes the SET NX and the GET atomic, the GET returns
+            # whichever job holds the key once the SET has run.
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.set(key, job_id, nx=True, ex=self.ttl)
+            pipe.get(key)
+            claimed, holder = pipe.execute()
+        except redis.exceptions.RedisError:
+            return None
+        if claimed or holder is None:
+            return None
+        return holder.decode('utf-8')
+
+    def release(self, user_id, name, job_id):
+        """Release the claim, only if it still belongs to the job.
+        """
+        if self.redis is None:
+            return
+        key = self._key(user_id, name)
+
+        def compare_and_delete(pipe):
+            holder = pipe.get(key)
+            pipe.multi()
+            if holder is not None and holder.decode('utf-8') == job_id:
+                pipe.delete(key)
+
+        try:
+            self.redis.transaction(compare_and_delete, key)
+        except redis.exceptions.RedisError:
+            pass
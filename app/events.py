@@ -0,0 +1,103 @@
+import json
+import queue
+import threading
+import time
+
+import redis
+
+from app.process_local import ProcessLocal
+
+
+class TaskEvents(object):
+    """Task progress events over redis pub/sub.
+        The rq workers `publish()` on a channel per user. Every web process
+        holds a single pattern subscription, read by a background thread, and
+        fans the messages out to the queues of its connected clients, so an
+        idle client costs no redis connection.
+
+        NOTE: a client that does not keep up loses the intermediate events
+        once its queue of `SSE_QUEUE_SIZE` events is full, the next progress
+        event supersedes them anyway.
+    """
+    prefix = 'tasks:user:'
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.queue_size = 100
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._listener = ProcessLocal(self._start_listener)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.redis = app.redis
+        self.queue_size = app.config['SSE_QUEUE_SIZE']
+
+    def publish(self, user_id, event):
+        """
+        Args:
+            user_id (int): the user the event is for.
+            event (dict): json serializable data.
+        """
+        try:
+            self.redis.publish(self.prefix + str(user_id),
+                               json.dumps(event, separators=(',', ':')))
+        except redis.exceptions.RedisError:
+            pass
+
+    def subscribe(self, user_id):
+        """
+        Args:
+            user_id (int): the user to receive the events of.
+
+        Returns:
+            Queue: the raw json of the events, pass it to `unsubscribe()` once done.
+        """
+        events = queue.Queue(self.queue_size)
+        self._listener.get()
+        with self._lock:
+            self._clients.setdefault(user_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            clients = self._clients.get(user_id)
+            if clients is not None:
+                clients.discard(events)
+                if not clients:
+                    del self._clients[user_id]
+
+    def _dispatch(self, channel, data):
+        try:
+            user_id = int(channel.decode('utf-8')[len(self.prefix):])
+        except ValueError:
+            return
+        with self._lock:
+            clients = list(self._clients.get(user_id, ()))
+        for events in clients:
+            try:
+                events.put_nowait(data)
+            except queue.Full:
+                pass
+
+    def _start_listener(self):
+        # the clients inherited from the parent process are not ours.
+        with self._lock:
+            self._clients = {}
+        listener = threading.Thread(target=self._listen, daemon=True)
+        listener.start()
+        return listener
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message['type'] == 'pmessage':
+                        self._dispatch(message['channel'], message['data'])
+            except redis.exceptions.RedisError:
+                # redis went away, subscribe again once it is back.
+                time.sleep(1)
@@ -0,0 +1,126 @@
+import abc
+from datetime import date, datetime
+import json
+import time
+import uuid
+
+from flask import current_app
+
+from app.metrics import record_timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONProvider(abc.ABC):
+    """Encodes the API responses, `app.json_provider` is the one in use.
+        Flask 1.1 has no pluggable json provider yet, so the API goes through
+        `app.json_provider.jsonify` instead of `flask.jsonify`.
+
+        The output is compact unless `JSON_COMPACT` is False, when it is None
+        it follows Flask: pretty printed in debug mode or with
+        `JSONIFY_PRETTYPRINT_REGULAR`.
+    """
+    name = None
+
+    def __init__(self, app):
+        self.app = app
+
+    @property
+    def compact(self):
+        compact = self.app.config.get('JSON_COMPACT')
+        if compact is None:
+            return not (self.app.config['JSONIFY_PRETTYPRINT_REGULAR'] or self.app.debug)
+        return compact
+
+    @staticmethod
+    def default(obj):
+        """the types json does not know about.
+        """
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        raise TypeError('Object of type {} is not JSON serializable'.format(
+            type(obj).__name__))
+
+    @abc.abstractmethod
+    def dumps(self, obj, compact=None):
+        """
+        Args:
+            obj (object): the data to encode.
+            compact (boolean): overrides the `compact` property, newline
+                delimited json needs it.
+
+        Returns:
+            bytes: utf-8 encoded json, with a trailing newline.
+        """
+
+    def jsonify(self, *args, **kwargs):
+        """same as `flask.jsonify`.
+        """
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+        if len(args) == 1:
+            data = args[0]
+        else:
+            data = args or kwargs
+        start = time.perf_counter()
+        body = self.dumps(data)
+        record_timing('json', time.perf_counter() - start)
+        return self.app.response_class(body, mimetype=self.app.config['JSONIFY_MIMETYPE'])
+
+
+class StdlibJSONProvider(JSONProvider):
+    name = 'stdlib'
+
+    def dumps(self, obj, compact=None):
+        if self.compact if compact is None else compact:
+            indent, separators = None, (',', ':')
+        else:
+            indent, separators = 2, (',', ': ')
+        return (json.dumps(obj, default=self.default, indent=indent,
+                           separators=separators,
+                           sort_keys=self.app.config['JSON_SORT_KEYS'],
+                           ensure_ascii=self.app.config['JSON_AS_ASCII'])
+                + '\n').encode('utf-8')
+
+
+class OrjsonJSONProvider(JSONProvider):
+    """encodes with `orjson`, which handles `datetime` natively.
+    """
+    name = 'orjson'
+
+    def dumps(self, obj, compact=None):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if not (self.compact if compact is None else compact):
+            option |= orjson.OPT_INDENT_2
+        if self.app.config['JSON_SORT_KEYS']:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+
+def make_json_provider(app):
+    """picks the provider from the `JSON_PROVIDER` config.
+
+    Args:
+        app (Flask): the application.
+
+    Returns:
+        JSONProvider: 'orjson' when it is installed and the config is 'auto'
+            (the default), otherwise the stdlib one.
+    """
+    name = app.config.get('JSON_PROVIDER') or 'auto'
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        if orjson is None:
+            raise RuntimeError('JSON_PROVIDER is orjson, but it is not installed')
+        return OrjsonJSONProvider(app)
+    return StdlibJSONProvider(app)
+
+
+def jsonify(*args, **kwargs):
+    """`flask.jsonify` through the provider of the current application.
+    """
+    return current_app.json_provider.jsonify(*args, **kwargs)
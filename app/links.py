@@ -0,0 +1,119 @@
+import re
+
+from flask import _app_ctx_stack, _request_ctx_stack, url_for
+
+# values made of these characters are never changed by the url quoting,
+# so they can be substituted into a template as they are.
+SAFE_VALUE = re.compile(r'^[A-Za-z0-9_.~-]*$')
+# every placeholder is built with its own sentinel, all of them have the
+# same number of digits so that one can not be found inside another.
+SENTINEL = 9000000000000000000
+MAX_TEMPLATES = 512
+
+
+class LinkTemplate(object):
+    """A url resolved once by `url_for`, with the placeholder values to be
+        filled in by string substitution.
+    """
+
+    def __init__(self, parts, names):
+        self.parts = parts
+        self.names = names
+
+    def fill(self, values):
+        url = [self.parts[0]]
+        for name, part in zip(self.names, self.parts[1:]):
+            url.append(str(values[name]))
+            url.append(part)
+        return ''.join(url)
+
+
+class UrlForTemplate(object):
+    """The fallback when no template can be built, it simply calls `url_for`.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def fill(self, values):
+        return url_for(self.endpoint, **values)
+
+
+def _build_template(endpoint, values, names):
+    sentinels = {}
+    build_values = dict(values)
+    for i, name in enumerate(names):
+        sentinels[name] = str(SENTINEL + i + 1)
+        build_values[name] = SENTINEL + i + 1
+    url = url_for(endpoint, **build_values)
+    positions = []
+    for name in names:
+        if url.count(sentinels[name]) != 1:
+            return None
+        positions.append((url.index(sentinels[name]), name))
+    positions.sort()
+    parts, ordered, start = [], [], 0
+    for position, name in positions:
+        parts.append(url[start:position])
+        ordered.append(name)
+        start = position + len(sentinels[name])
+    parts.append(url[start:])
+    template = LinkTemplate(parts, ordered)
+    # the first use is checked against url_for, a converter that changes
+    # the values would make the template unusable.
+    if template.fill(values) != url_for(endpoint, **values):
+        return None
+    return template
+
+
+def link_template(endpoint, **values):
+    """Resolve the url rule of the endpoint once per app (and script root).
+        The ints and the url safe strings among the values become placeholders,
+        any other value is part of the template.
+
+    Args:
+        endpoint (string): an absolute endpoint such as 'api.get_user'.
+        values: sample url values, as for `url_for`.
+
+    Returns:
+        LinkTemplate: call `fill(values)` with values of the same kinds and
+            in the same order to get the same url as `url_for`.
+    """
+    if endpoint.startswith('.') or any(name.startswith('_') for name in values):
+        return UrlForTemplate(endpoint)
+    # NOTE: this may be called once per item of a page, so it reads the
+    # context stacks directly rather than going through the proxies.
+    ctx = _request_ctx_stack.top
+    names, key = [], [endpoint, ctx.request.script_root if ctx is not None else None]
+    for name, value in values.items():
+        if type(value) is int or (type(value) is str and SAFE_VALUE.match(value)):
+            names.append(name)
+            key.append(name)
+        else:
+            key.append((name, value))
+    key = tuple(key)
+    templates = _app_ctx_stack.top.app.extensions.setdefault('link_templates', {})
+    try:
+        template = templates.get(key)
+    except TypeError:
+        return UrlForTemplate(endpoint)
+    if template is None:
+        template = _build_template(endpoint, values, names) or UrlForTemplate(endpoint)
+        if len(templates) < MAX_TEMPLATES:
+            templates[key] = template
+    return template
+
+
+def link_for(endpoint, **values):
+    """A drop-in replacement of `url_for` for the `_links` of the API,
+        see `link_template`. When the same link is built for every item of a
+        page, get the template once and `fill` it instead.
+
+    Args:
+        endpoint (string): an absolute endpoint such as 'api.get_user'.
+        values: the url values, as for `url_for`.
+
+    Returns:
+        string: the url.
+    """
+    return link_template(endpoint, **values).fill(values)
@@ -0,0 +1,180 @@
+import copy
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+
+from flask import current_app, g, has_request_context, request
+from flask.logging import default_handler
+
+from app.process_local import ProcessLocal
+
+# the attributes of every LogRecord, anything else was passed with `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime'}
+# an incoming `X-Request-ID` is only trusted when it looks like an id.
+REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class JSONFormatter(logging.Formatter):
+    """one json object per line, with the fields passed in `extra`.
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class RequestFilter(logging.Filter):
+    """adds the id of the current request to the records.
+    """
+
+    def filter(self, record):
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """keeps a `rate` fraction of the records below WARNING.
+    """
+
+    def __init__(self, rate):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or \
+            random.random() < self.rate
+
+
+class ProcessQueueHandler(QueueHandler):
+    """A `QueueHandler` whose `QueueListener` writes to a handler of its own
+        process (see `ProcessLocal`), so the request threads only put the
+        records on a queue. When the queue is full the records are dropped
+        rather than blocking the request, `dropped` counts them.
+    """
+
+    def __init__(self, make_handler, maxsize=10000):
+        super(ProcessQueueHandler, self).__init__(None)
+        self.make_handler = make_handler
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = ProcessLocal(self._start)
+
+    def _start(self):
+        listener = QueueListener(queue.Queue(self.maxsize), self.make_handler(),
+                                 respect_handler_level=True)
+        listener.start()
+        return listener
+
+    def prepare(self, record):
+        # NOTE: the formatting is left to the listener thread, only the
+        # message and the traceback are rendered here, while they are valid.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self._listener.get().queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """writes the records queued so far and stops the listener of the
+            current process, the next record starts a new one. The rq work
+            horses call it before they leave with `os._exit`, see `worker.py`.
+        """
+        listener = self._listener.pop()
+        if listener is not None:
+            listener.stop()
+            listener.handlers[0].close()
+
+    def close(self):
+        self.flush()
+        super(ProcessQueueHandler, self).close()
+
+
+def _make_handler(app):
+    """the handler the listener of the current process writes to: stdout, or
+        a log file of its own so that the workers never rotate each other's.
+        The file is named after `LOG_FILE_ID`, the pid by default.
+    """
+    if app.config['LOG_TO_STDOUT']:
+        handler = logging.StreamHandler(sys.stdout)
+    else:
+        log_dir = app.config['LOG_DIR']
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(log_dir, 'application.{}.log'.format(
+                app.config['LOG_FILE_ID'] or os.getpid())),
+            maxBytes=app.config['LOG_MAX_BYTES'],
+            backupCount=app.config['LOG_BACKUP_COUNT'])
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def _start_request():
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if REQUEST_ID.match(request_id) else uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+
+
+def _log_request(response):
+    if 'request_start' not in g:
+        return response
+    response.headers['X-Request-ID'] = g.request_id
+    current_app.logger.info('%s %s %s', request.method, request.path,
+                            response.status_code, extra={
+                                'method': request.method,
+                                'path': request.path,
+                                'status': response.status_code,
+                                'latency_ms': round((time.perf_counter() - g.request_start)
+                                                    * 1000, 2)})
+    return response
+
+
+def init_logging(app):
+    """logs the application, and one line per request with its latency, as
+        json records through a `ProcessQueueHandler`.
+
+    Args:
+        app (Flask): the application.
+    """
+    handler = ProcessQueueHandler(lambda: _make_handler(app), app.config['LOG_QUEUE_SIZE'])
+    handler.setLevel(logging.INFO)
+    handler.addFilter(SamplingFilter(app.config['LOG_SAMPLE_RATE']))
+    handler.addFilter(RequestFilter())
+    # the default handler of Flask writes to stderr on the request thread.
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(handler)
+    app.logger.setLevel(logging.INFO)
+    app.before_request(_start_request)
+    app.after_request(_log_request)
+    return handler
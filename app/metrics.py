@@ -0,0 +1,289 @@
+from bisect import bisect_left
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+
+from flask import _app_ctx_stack, g, request
+import redis
+from redis import Redis
+from redis.client import Pipeline
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RequestStats(object):
+    """what one request spent, kept in `g` while the request runs.
+    """
+    __slots__ = ('start', 'sql_count', 'sql_time', 'redis_count', 'timings')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.timings = {}
+
+
+def current_stats():
+    """
+    Returns:
+        RequestStats: the stats of the current request, None outside of a
+            request or when the metrics are disabled.
+    """
+    # NOTE: called for every SQL statement and redis command, so it reads the
+    # context stack directly rather than going through the `g` proxy.
+    ctx = _app_ctx_stack.top
+    if ctx is None:
+        return None
+    return getattr(ctx.g, '_metrics', None)
+
+
+def record_timing(name, seconds):
+    """adds a duration to the `Server-Timing` header of the current request.
+
+    Args:
+        name (string): a token such as 'json'.
+        seconds (float): the time spent.
+    """
+    stats = current_stats()
+    if stats is not None:
+        stats.timings[name] = stats.timings.get(name, 0.0) + seconds
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    starts = conn.info.get('metrics_start')
+    if stats is not None and starts:
+        stats.sql_count += 1
+        stats.sql_time += time.perf_counter() - starts.pop()
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        stats = current_stats()
+        if stats is not None:
+            stats.redis_count += len(self.command_stack)
+        return super(InstrumentedPipeline, self).execute(raise_on_error)
+
+    def immediate_execute_command(self, *args, **options):
+        stats = current_stats()
+        if stats is not None:
+            stats.redis_count += 1
+        return super(InstrumentedPipeline, self).immediate_execute_command(*args, **options)
+
+
+class InstrumentedRedis(Redis):
+    """`redis.Redis` counting the commands sent by the current request.
+    """
+
+    def execute_command(self, *args, **options):
+        stats = current_stats()
+        if stats is not None:
+            stats.redis_count += 1
+        return super(InstrumentedRedis, self).execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks,
+                                    transaction, shard_hint)
+
+
+class Metrics(object):
+    """Request metrics of the application, in the Prometheus text format at
+        `/metrics`: a latency histogram per endpoint, and the SQL statements,
+        SQL time and redis commands they used.
+
+        Every process keeps its own numbers and writes them to the redis hash
+        `metrics:processes` every `METRICS_FLUSH_INTERVAL` seconds, `/metrics`
+        adds up the processes that reported recently. Set `METRICS_SERVER_TIMING`
+        to also send the numbers of every request in a `Server-Timing` header.
+
+        `/metrics` tells the traffic of every endpoint, set `METRICS_TOKEN` (or
+        restrict it to the scraper in nginx) rather than publishing it.
+    """
+    key = 'metrics:processes'
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.buckets = []
+        self.flush_interval = 10
+        self.server_timing = False
+        self.token = None
+        self._data = {}
+        self._lock = threading.Lock()
+        self._next_flush = 0
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.redis = app.redis
+        self.buckets = sorted(app.config['METRICS_BUCKETS'])
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        self.server_timing = app.config['METRICS_SERVER_TIMING']
+        self.token = app.config['METRICS_TOKEN']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def _before_request(self):
+        g._metrics = RequestStats()
+
+    def _after_request(self, response):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats.start
+        if self.server_timing:
+            timings = ['app;dur={:.1f}'.format(duration * 1000),
+                       'sql;dur={:.1f};desc="{} queries"'.format(stats.sql_time * 1000,
+                                                                 stats.sql_count),
+                       'redis;desc="{} commands"'.format(stats.redis_count)]
+            timings.extend('{};dur={:.1f}'.format(name, seconds * 1000)
+                           for name, seconds in stats.timings.items())
+            response.headers['Server-Timing'] = ', '.join(timings)
+        self.observe(request.endpoint, request.method, response.status_code,
+                     duration, stats)
+        return response
+
+    def _teardown_request(self, exc):
+        # the after request handlers do not run on an unhandled exception.
+        stats = g.pop('_metrics', None)
+        if stats is not None:
+            self.observe(request.endpoint, request.method, 500,
+                         time.perf_counter() - stats.start, stats)
+
+    def observe(self, endpoint, method, status, duration, stats):
+        key = '{}|{}|{}'.format(endpoint or 'none', method, status)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                entry = self._data[key] = {'buckets': [0] * (len(self.buckets) + 1),
+                                           'sum': 0.0, 'count': 0, 'sql': 0,
+                                           'sql_time': 0.0, 'redis': 0}
+            entry['buckets'][bisect_left(self.buckets, duration)] += 1
+            entry['sum'] += duration
+            entry['count'] += 1
+            entry['sql'] += stats.sql_count
+            entry['sql_time'] += stats.sql_time
+            entry['redis'] += stats.redis_count
+        if time.time() >= self._next_flush:
+            self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            data = {key: dict(entry, buckets=list(entry['buckets']))
+                    for key, entry in self._data.items()}
+        return {'requests': data, 'token_cache': self._app.token_cache.stats,
+                'time': time.time()}
+
+    def flush(self):
+        """writes the numbers of this process to redis.
+        """
+        self._next_flush = time.time() + self.flush_interval
+        try:
+            self.redis.hset(self.key, '{}:{}'.format(socket.gethostname(), os.getpid()),
+                            json.dumps(self.snapshot()))
+        except redis.exceptions.RedisError:
+            pass
+
+    def collect(self):
+        """
+        Returns:
+            list: the snapshots of the processes that reported in the last
+                three flush intervals, or only this one without redis.
+        """
+        self.flush()
+        try:
+            raw = self.redis.hgetall(self.key)
+        except redis.exceptions.RedisError:
+            return [self.snapshot()]
+        snapshots, stale = [], []
+        for field, value in raw.items():
+            snapshot = json.loads(value)
+            if snapshot['time'] < time.time() - 3 * self.flush_interval:
+                stale.append(field)
+            else:
+                snapshots.append(snapshot)
+        if stale:
+            try:
+                self.redis.hdel(self.key, *stale)
+            except redis.exceptions.RedisError:
+                pass
+        return snapshots
+
+    def render(self):
+        """
+        Returns:
+            string: all the processes added up, in the Prometheus text format.
+        """
+        requests, token_cache = {}, {}
+        for snapshot in self.collect():
+            for key, entry in snapshot['requests'].items():
+                total = requests.get(key)
+                if total is None or len(total['buckets']) != len(entry['buckets']):
+                    requests[key] = entry
+                    continue
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+                for name in ('sum', 'count', 'sql', 'sql_time', 'redis'):
+                    total[name] += entry[name]
+            for name, value in snapshot['token_cache'].items():
+                token_cache[name] = token_cache.get(name, 0) + value
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by endpoint.',
+            '# TYPE http_request_duration_seconds histogram']
+        bounds = ['{:g}'.format(bound) for bound in self.buckets] + ['+Inf']
+        for key in sorted(requests):
+            entry, labels = requests[key], self._labels(key)
+            cumulative = 0
+            for bound, count in zip(bounds, entry['buckets']):
+                cumulative += count
+                lines.append('http_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                    labels, bound, cumulative))
+            lines.append('http_request_duration_seconds_sum{{{}}} {}'.format(labels, entry['sum']))
+            lines.append('http_request_duration_seconds_count{{{}}} {}'.format(labels, entry['count']))
+        for name, field, help in (
+                ('http_request_sql_queries_total', 'sql', 'SQL statements run by the requests.'),
+                ('http_request_sql_seconds_total', 'sql_time', 'Time spent in SQL statements.'),
+                ('http_request_redis_commands_total', 'redis', 'Redis commands sent by the requests.')):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} counter'.format(name))
+            for key in sorted(requests):
+                lines.append('{}{{{}}} {}'.format(name, self._labels(key), requests[key][field]))
+        lines.append('# HELP token_cache_lookups_total Bearer token lookups by outcome.')
+        lines.append('# TYPE token_cache_lookups_total counter')
+        for name in sorted(token_cache):
+            lines.append('token_cache_lookups_total{{outcome="{}"}} {}'.format(
+                name, token_cache[name]))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(key):
+        endpoint, method, status = key.split('|')
+        return 'endpoint="{}",method="{}",status="{}"'.format(endpoint, method, status)
+
+    def view(self):
+        """`GET /metrics`, for Prometheus (`bearer_token` in its scrape config
+            when `METRICS_TOKEN` is set).
+        """
+        if self.token is not None:
+            expected = 'Bearer {}'.format(self.token).encode('utf-8')
+            if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                       expected):
+                from app.api.errors import error_response
+                response = error_response(401)
+                response.headers['WWW-Authenticate'] = 'Bearer'
+                return response
+        return self._app.response_class(self.render(),
+                                        mimetype='text/plain; version=0.0.4')
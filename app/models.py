@@ -1,23 +1,74 @@
 from collections import namedtuple
+from sqlalchemy import event, exists, literal, select
 from sqlalchemy.orm import backref, lazyload
+from sqlalchemy.orm.session import make_transient_to_detached
 from app import db
+from app.links import link_for, link_template
+from app.queues import route_task
+from app.signed_tokens import SIGNED_TOKEN_PATTERN
 
-from flask import url_for
 from flask import current_app
 
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 # for token
 import base64
 from datetime import datetime, timedelta
+import math
 import os
+import re
+import uuid
 
 import redis
 import rq
 
+# the largest id of the `db.Integer` id columns, a 32-bit INTEGER on PostgreSQL
+# and MySQL. SQLite would hold 64 bits, but no other backend has such ids.
+MAX_ID = 2 ** 31 - 1
+
 
 class PaginatedAPIMixin(object):
     @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
+    def encode_cursor(last_id):
+        """builds the opaque cursor handed out to the clients.
+
+        Args:
+            last_id (int): the id of the last item of a page.
+
+        Returns:
+            string: url safe cursor.
+        """
+        return base64.urlsafe_b64encode(str(last_id).encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """the reverse direction of encode_cursor function.
+
+        Args:
+            cursor (string): a cursor from the request, an empty one starts from
+                the beginning of the collection.
+
+        Raises:
+            ValueError: the cursor was not issued by encode_cursor.
+
+        Returns:
+            int: the id of the last item already seen.
+        """
+        if not cursor:
+            return 0
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            last_id = int(base64.urlsafe_b64decode(cursor + padding).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeDecodeError, base64.binascii.Error):
+            raise ValueError('invalid cursor')
+        if not 0 <= last_id <= MAX_ID:
+            raise ValueError('invalid cursor')
+        return last_id
+
+
+    @classmethod
+    def to_collection_dict(cls, query, page, per_page, endpoint, cursor=None,
+                           count=None, fields=None, total=None, **kwargs):
         """ produces a dictionary with the user collection representation
 
         Args:
@@ -25,38 +76,156 @@ class PaginatedAPIMixin(object):
             page (int): a page number.
             per_page (int): a page size.
                 The first 3 args that determine what are the items that are going to be returned.
-            endpoint ([type]): [description]
+            endpoint (string): the endpoint used to build the `_links`.
+            cursor (string): switches to keyset pagination when it is not None,
+                see `to_cursor_collection_dict`. `page` is ignored then.
+            count (string): how the totals are computed, 'exact', 'cached'
+                (through `app.count_cache`) or 'none' to leave them out.
+                Defaults to the `API_COUNT_MODE` config.
+            fields (string): comma separated sparse fieldset, see `parse_fields`.
+                Only the columns needed by those fields are loaded, as plain
+                rows rather than model objects.
+            total (int): the number of items when the caller already knows it,
+                such as a denormalized counter, nothing is counted then.
+
+        Raises:
+            ValueError: the cursor, the count mode or the fields are invalid.
+
+        Returns:
+            dict: the collection representation.
+        """
+        if cursor is not None:
+            return cls.to_cursor_collection_dict(query, cursor, per_page, endpoint,
+                                                  count=count, fields=fields, **kwargs)
+        mode = count or current_app.config['API_COUNT_MODE']
+        if mode not in ('exact', 'cached', 'none'):
+            raise ValueError('invalid count')
+        selected = cls.parse_fields(fields)
+        serialize = cls.serializer(selected)
+        page = max(page, 1)
+        # one extra row tells whether there is a next page, without a count.
+        # NOTE: ordering by id keeps the pages stable, the projection may
+        # otherwise be served from an index in a different order.
+        items = query.with_entities(*cls.columns_for(selected)).order_by(cls.id) \
+            .limit(per_page + 1).offset((page - 1) * per_page).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        meta = {
+            'page': page,
+            'per_page': per_page
+        }
+        if mode == 'none':
+            meta['count'] = 'omitted'
+        elif total is not None:
+            meta['total_pages'] = int(math.ceil(total / float(per_page)))
+            meta['total_items'] = total
+            meta['count'] = 'exact'
+        else:
+            # count the ids only, instead of a subquery over every column.
+            id_query = query.with_entities(cls.id)
+            if mode == 'cached':
+                total, cached = current_app.count_cache.count(cls.__tablename__, id_query)
+            else:
+                total, cached = id_query.order_by(None).count(), False
+            meta['total_pages'] = int(math.ceil(total / float(per_page)))
+            meta['total_items'] = total
+            meta['count'] = 'cached' if cached else 'exact'
+        data = {
+            'items': [serialize(item) for item in items],
+            '_meta': meta,
+            '_links': {
+                'self': link_for(endpoint, page=page, per_page=per_page,
+                                 count=count, fields=fields, **kwargs),
+                'next': link_for(endpoint, page=page + 1, per_page=per_page,
+                                 count=count, fields=fields, **kwargs) if has_next else None,
+                'prev': link_for(endpoint, page=page - 1, per_page=per_page,
+                                 count=count, fields=fields, **kwargs) if page > 1 else None
+            }
+        }
+        return data
+
+
+    @classmethod
+    def to_cursor_collection_dict(cls, query, cursor, per_page, endpoint, count=None,
+                                  fields=None, **kwargs):
+        """ the keyset pagination flavour of to_collection_dict.
+            Instead of `LIMIT/OFFSET` plus a `COUNT(*)`, it seeks past the last
+            id seen and fetches one extra row to find out whether there is a
+            next page, so deep pages cost the same as the first one.
+
+        Args:
+            query (object): a Flask-SQLAlchemy query object.
+            cursor (string): from encode_cursor, or an empty string for the first page.
+            per_page (int): a page size.
+            endpoint (string): the endpoint used to build the `_links`.
+            count (string): only carried over to the `_links`, the keyset
+                pagination never counts.
+            fields (string): comma separated sparse fieldset, see `parse_fields`.
+
+        Raises:
+            ValueError: the cursor or the fields are invalid.
 
         Returns:
-            [type]: [description]
+            dict: the collection representation.
         """
-        resources = query.paginate(page, per_page, False)
+        last_id = cls.decode_cursor(cursor)
+        selected = cls.parse_fields(fields)
+        serialize = cls.serializer(selected)
+        items = query.with_entities(*cls.columns_for(selected)) \
+            .filter(cls.id > last_id).order_by(cls.id).limit(per_page + 1).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        next_cursor = cls.encode_cursor(items[-1].id) if has_next else None
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': [serialize(item) for item in items],
             '_meta': {
-                'page': page,
                 'per_page': per_page,
-                'total_pages': resources.pages,
-                'total_items': resources.total
+                'cursor': cursor,
+                'next_cursor': next_cursor,
+                'count': 'omitted'
             },
             '_links': {
-                'self': url_for(endpoint, page=page, per_page=per_page,
-                                **kwargs),
-                'next': url_for(endpoint, page=page + 1, per_page=per_page,
-                                **kwargs) if resources.has_next else None,
-                'prev': url_for(endpoint, page=page - 1, per_page=per_page,
-                                **kwargs) if resources.has_prev else None
+                'self': link_for(endpoint, cursor=cursor, per_page=per_page,
+                                 count=count, fields=fields, **kwargs),
+                'next': link_for(endpoint, cursor=next_cursor, per_page=per_page,
+                                 count=count, fields=fields, **kwargs) if has_next else None,
+                'prev': None
             }
         }
         return data
 
 
+# NOTE: the primary key answers "does A follow B" and "who does A follow",
+# the reverse index answers "who follows B".
 followers = db.Table(
     'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id')
 )
 
+# `get_token` issues the base64 encoding of 24 random bytes.
+TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9+/]{32}$')
+
+
+def _invalidate_after_commit(token):
+    # NOTE: invalidating before the commit lets a concurrent request read the
+    # old row and cache the token again.
+    if token:
+        db.session.info.setdefault('invalidated_tokens', set()).add(token)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_tokens(session):
+    for token in session.info.pop('invalidated_tokens', ()):
+        current_app.token_cache.invalidate(token)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_tokens(session):
+    session.info.pop('invalidated_tokens', None)
+
+
 class User(PaginatedAPIMixin, db.Model,):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
@@ -67,42 +236,236 @@ class User(PaginatedAPIMixin, db.Model,):
 
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime)
+    # bumped by `revoke_token` in the signed token mode, see `app.signed_tokens`.
+    token_generation = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     # many to many relationship. From part viii
     followed = db.relationship(
         'User', secondary=followers,
         primaryjoin=(followers.c.follower_id == id),
         secondaryjoin=(followers.c.followed_id == id),
         backref=db.backref('followers', lazy='dynamic'), lazy='dynamic')
+    # denormalized sizes of `followers` and `followed`, maintained by follow()
+    # and unfollow() in the same transaction as the followers table.
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    followed_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # add task relationship
     tasks = db.relationship('Task', backref='user', lazy='dynamic')
 
+    # the fields a client can select with `fields=`, and the columns they are built from.
+    API_FIELDS = {
+        'id': ('id',),
+        'username': ('username',),
+        'last_seen': ('last_seen',),
+        'follower_count': ('follower_count',),
+        'followed_count': ('followed_count',),
+        '_links': ('id',)
+    }
+    DEFAULT_API_FIELDS = ('id', 'username', '_links')
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """NOTE: it may raise `app.passwords.PasswordPoolBusy`.
+        """
+        return current_app.password_hasher.check(self.username, self.password_hash,
+                                                 password)
+
+
+    def is_following(self, user):
+        """a primary key lookup in the followers table.
+
+        Args:
+            user (User): the followed user.
+
+        Returns:
+            boolean
+        """
+        return db.session.query(followers.c.follower_id).filter(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == user.id).first() is not None
+
+
+    def _add_to_follow_counts(self, user, delta):
+        User.query.filter_by(id=self.id).update(
+            {User.followed_count: User.followed_count + delta}, synchronize_session=False)
+        User.query.filter_by(id=user.id).update(
+            {User.follower_count: User.follower_count + delta}, synchronize_session=False)
+        db.session.expire(self, ['followed_count'])
+        db.session.expire(user, ['follower_count'])
+
+
+    def follow(self, user):
+        """follow the user, the counts of both users are updated in the same
+            transaction. Like launch_task(), it does not commit.
+
+        Args:
+            user (User): the user to follow.
+
+        Returns:
+            boolean: False if it was already followed.
+        """
+        if self.id == user.id or self.is_following(user):
+            return False
+        db.session.execute(followers.insert().values(follower_id=self.id,
+                                                     followed_id=user.id))
+        self._add_to_follow_counts(user, 1)
+        return True
+
+
+    def unfollow(self, user):
+        """the reverse direction of follow function.
+
+        Returns:
+            boolean: False if it was not followed.
+        """
+        result = db.session.execute(followers.delete().where(
+            (followers.c.follower_id == self.id) & (followers.c.followed_id == user.id)))
+        if result.rowcount == 0:
+            return False
+        self._add_to_follow_counts(user, -1)
+        return True
+
+
+    def following_among(self, ids):
+        """the set-based version of is_following, a single IN probe.
+
+        Args:
+            ids (iterable): user ids.
+
+        Returns:
+            set: the ids among them that this user follows.
+        """
+        return {id for (id,) in db.session.query(followers.c.followed_id).filter(
+            followers.c.follower_id == self.id, followers.c.followed_id.in_(ids))}
+
+
+    def _add_to_follow_counts_many(self, ids, delta, changed):
+        user = User.__table__
+        if changed == len(ids):
+            db.session.execute(user.update().where(user.c.id.in_(ids))
+                               .values(follower_count=user.c.follower_count + delta))
+            db.session.execute(user.update().where(user.c.id == self.id)
+                               .values(followed_count=user.c.followed_count + delta * changed))
+        else:
+            # a concurrent request changed some of the rows, count them again.
+            db.session.execute(user.update().where(user.c.id.in_(ids)).values(
+                follower_count=select([db.func.count()])
+                .where(followers.c.followed_id == user.c.id).as_scalar()))
+            db.session.execute(user.update().where(user.c.id == self.id).values(
+                followed_count=select([db.func.count()])
+                .where(followers.c.follower_id == user.c.id).as_scalar()))
+        db.session.expire(self, ['followed_count'])
+
+
+    def follow_many(self, ids):
+        """follow many users with a single `INSERT ... SELECT`, skipping the
+            ones already followed. Like follow(), it does not commit.
+
+        Args:
+            ids (iterable): user ids, unknown ones are ignored.
+
+        Returns:
+            set: the ids that were not followed before.
+        """
+        ids = set(ids) - {self.id}
+        if not ids:
+            return set()
+        user = User.__table__
+        new_ids = {id for (id,) in db.session.query(user.c.id).filter(user.c.id.in_(ids))} \
+            - self.following_among(ids)
+        if not new_ids:
+            return set()
+        existing = followers.alias('existing')
+        result = db.session.execute(followers.insert().from_select(
+            ['follower_id', 'followed_id'],
+            select([literal(self.id), user.c.id]).where(user.c.id.in_(new_ids)).where(
+                ~exists().where((existing.c.follower_id == self.id) &
+                                (existing.c.followed_id == user.c.id)))))
+        self._add_to_follow_counts_many(new_ids, 1, result.rowcount)
+        return new_ids
+
+
+    def unfollow_many(self, ids):
+        """the reverse direction of follow_many function, a single `DELETE`.
+
+        Returns:
+            set: the ids that were followed before.
+        """
+        old_ids = self.following_among(set(ids))
+        if not old_ids:
+            return set()
+        result = db.session.execute(followers.delete().where(
+            (followers.c.follower_id == self.id) & followers.c.followed_id.in_(old_ids)))
+        self._add_to_follow_counts_many(old_ids, -1, result.rowcount)
+        return old_ids
+
+
+    @staticmethod
+    def mutual_followers(id, other_id):
+        """the users following both users, a self-join of the followers table.
+
+        Args:
+            id (int): a user id.
+            other_id (int): another user id.
+
+        Returns:
+            query: the users.
+        """
+        a, b = followers.alias('a'), followers.alias('b')
+        return User.query.join(a, a.c.follower_id == User.id) \
+            .join(b, b.c.follower_id == a.c.follower_id) \
+            .filter(a.c.followed_id == id, b.c.followed_id == other_id)
+
+
+    def launch_task(self, name, description, *args, queue=None, **kwargs):
+        """enqueue the task from the `tasks.py`, unless the same task of the user
+            is already in flight (see `app.cache.InflightTasks`).
 
+        NOTE: launch_task() adds the new task object to the session, but it does not issue a commit.
 
-    def launch_task(self, name, description, *args, **kwargs):
-        # enqueue the task from the `tasks.py`
-        # NOTE: launch_task() adds the new task object to the session, but it does not issue a commit. 
-        rq_job = current_app.task_queue.enqueue('app.tasks.' + name, self.id,
-                                                *args, **kwargs)
-        task = Task(id=rq_job.get_id(), name=name, description=description,
+        Args:
+            name (string): the task name, a function of `app.tasks`.
+            description (string): for showing to users.
+            queue (string): one of `TASK_QUEUES`, overrides the `TASK_ROUTES` config.
+
+        Raises:
+            ValueError: the queue is unknown.
+            TaskInProgress: the task is already in flight, its `job_id` is the
+                running job.
+
+        Returns:
+            Task: the new task object.
+        """
+        task_queue = route_task(current_app, name, queue)
+        job_id = str(uuid.uuid4())
+        inflight = current_app.inflight_tasks
+        running = inflight.acquire(self.id, name, job_id)
+        if running is not None:
+            raise TaskInProgress(running)
+        # NOTE: the callbacks release the claim however the job ends, a work
+        # horse which is killed keeps it until `TASK_INFLIGHT_TTL`.
+        release = rq.job.Callback('app.tasks._release_inflight')
+        try:
+            rq_job = task_queue.enqueue('app.tasks.' + name, self.id, *args, job_id=job_id,
+                                        on_success=release, on_failure=release,
+                                        on_stopped=release, **kwargs)
+        except Exception:
+            inflight.release(self.id, name, job_id)
+            raise
+        task = Task(id=rq_job.id, name=name, description=description,
                     user=self)
         db.session.add(task)
         return task
 
 
-    def get_task_in_progress(self):
+    def get_tasks_in_progress(self):
         """returns the complete list of functions that are outstanding for the user.
-            This method is for preventing users from starting two or more tasks
-            of the same type concurrently, so before I launch a task, I can use
-            this method to find out if a previous task is currently running.
+
         Returns:
-            Task: Task objects.
+            list: Task objects.
         """
         return Task.query.filter_by(user=self, complete=False).all()
 
@@ -116,13 +479,22 @@ class User(PaginatedAPIMixin, db.Model,):
         Returns:
             Task: task object
         """
-        return Task.query.filter_by(name=name, user=self, complete=False).first
+        return Task.query.filter_by(name=name, user=self, complete=False).first()
 
 
     def get_token(self, expires_in=3600):
+        """issues a token for the user. With `TOKEN_MODE = 'signed'` a new
+            signed token is returned and nothing is written, otherwise the
+            token is stored in the user row and reused until it nearly expires.
+        """
+        if current_app.config['TOKEN_MODE'] == 'signed':
+            return current_app.signed_tokens.issue(self.id, self.token_generation or 0,
+                                                   expires_in)
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
+        # the old token is rotated, drop it from the token cache as well.
+        _invalidate_after_commit(self.token)
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
@@ -130,33 +502,168 @@ class User(PaginatedAPIMixin, db.Model,):
 
 
     def revoke_token(self):
+        if current_app.config['TOKEN_MODE'] == 'signed':
+            # every signed token issued so far becomes invalid.
+            self.token_generation = (self.token_generation or 0) + 1
+            current_app.signed_tokens.revoke(self.id, self.token_generation)
+            return
+        _invalidate_after_commit(self.token)
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
 
 
+    @staticmethod
+    def is_well_formed_token(token):
+        """cheap format check, done before any lookup of the token.
+
+        Args:
+            token (string): From request
+
+        Returns:
+            boolean: whether the token could have been issued by `get_token`.
+        """
+        if current_app.config['TOKEN_MODE'] == 'signed':
+            return SIGNED_TOKEN_PATTERN.match(token) is not None
+        return TOKEN_PATTERN.match(token) is not None
+
+
     @staticmethod
     def check_token(token):
-        user = User.query.filter_by(token=token).first()
+        # NOTE: always on the primary, whatever the request method. A lagging
+        # replica would reject a token issued a moment ago, and accept a
+        # revoked one which the token cache would then keep. The token cache
+        # spares most of these lookups.
+        with db.replica_reads(False):
+            user = User.query.filter_by(token=token).first()
         if user is None or user.token_expiration < datetime.utcnow():
             return None
         return user
 
+
+    def to_token_snapshot(self):
+        """the columns kept by the token cache for this user.
+            Only the immutable parts of the token are kept, so that a renamed
+            user is never served from a stale snapshot.
+
+        Returns:
+            dict: json serializable snapshot of the user.
+        """
+        return {
+            'id': self.id,
+            'token': self.token,
+            'expires_at': (self.token_expiration - datetime(1970, 1, 1)).total_seconds()
+        }
+
+
+    @staticmethod
+    def from_token_snapshot(data):
+        """the reverse direction of to_token_snapshot function.
+            The user is attached to the session without a SELECT, the
+            columns missing from the snapshot are loaded on first access.
+
+        Args:
+            data (dict): a snapshot from `to_token_snapshot`, or only the `id`
+                of the user of a signed token.
+
+        Returns:
+            User
+        """
+        user = User(id=data['id'])
+        if 'token' in data:
+            user.token = data['token']
+            user.token_expiration = datetime.utcfromtimestamp(data['expires_at'])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     
-    def to_dict(self):
+    @classmethod
+    def parse_fields(cls, fields):
+        """parses the `fields` argument of a request.
+
+        Args:
+            fields (string): comma separated field names, None or empty for the
+                default representation.
+
+        Raises:
+            ValueError: one of the fields is unknown.
+
+        Returns:
+            tuple: the selected field names.
+        """
+        if not fields:
+            return cls.DEFAULT_API_FIELDS
+        selected = tuple(field.strip() for field in fields.split(','))
+        for field in selected:
+            if field not in cls.API_FIELDS:
+                raise ValueError('unknown field: {}'.format(field))
+        return selected
+
+
+    @classmethod
+    def columns_for(cls, fields):
+        """the columns to load for the selected fields, `id` is always included.
+
+        Args:
+            fields (tuple): from `parse_fields`.
+
+        Returns:
+            list: the column attributes.
+        """
+        names = ['id']
+        for field in fields:
+            for name in cls.API_FIELDS[field]:
+                if name not in names:
+                    names.append(name)
+        return [getattr(cls, name) for name in names]
+
+
+    @staticmethod
+    def serializer(fields=None):
+        """builds the function producing the representation of a user, from a
+            `User` or from a row loaded with `columns_for`.
+            The link template is resolved once, so reuse the function for all
+            the items of a page.
+
+        Args:
+            fields (tuple): from `parse_fields`, None for the default ones.
+
+        Returns:
+            function: takes anything with the selected columns as attributes,
+                returns the dict that represents the user.
+        """
+        fields = fields or User.DEFAULT_API_FIELDS
+        self_link = link_template('api.get_user', id=0)
+
+        def serialize(row):
+            data = {}
+            for field in fields:
+                if field == '_links':
+                    data['_links'] = {
+                        'self': self_link.fill({'id': row.id})
+                    }
+                else:
+                    data[field] = getattr(row, field)
+            return data
+        return serialize
+
+
+    @staticmethod
+    def serialize(row, fields=None):
+        """the representation of a single user, see `serializer`.
+        """
+        return User.serializer(fields)(row)
+
+
+    def to_dict(self, fields=None):
         """converts a user object to a Python representation,
             which will then be converted to JSON. 
 
+        Args:
+            fields (tuple): from `parse_fields`, None for the default ones.
+
         Returns:
             dict: the data represent the user object.
         """
-        data = {
-            'id': self.id,
-            'username': self.username,
-            '_links': {
-                'self': url_for('api.get_user', id=self.id)
-            }
-        }
-
-        return data
+        return User.serialize(self, fields)
 
 
     def from_dict(self, data, new_user=False):
@@ -177,6 +684,15 @@ class User(PaginatedAPIMixin, db.Model,):
         return '<User {}>'.format(self.username)
 
 
+class TaskInProgress(Exception):
+    """Raised by `User.launch_task` when the same task is already in flight.
+    """
+
+    def __init__(self, job_id):
+        super(TaskInProgress, self).__init__(job_id)
+        self.job_id = job_id
+
+
 class Task(db.Model):
     """
     The model is going to store the task's fully qualified name (as passed to RQ),
@@ -202,3 +718,46 @@ class Task(db.Model):
     def get_progress(self):
         job = self.get_rq_job()
         return job.meta.get('progress', 0) if job is not None else 100
+
+    @staticmethod
+    def get_rq_jobs(tasks):
+        """the bulk version of `get_rq_job`, all the jobs are read with a single
+            pipelined redis round trip.
+
+        Args:
+            tasks (list): Task objects.
+
+        Returns:
+            list: the rq jobs in the order of the tasks, None for a missing job.
+        """
+        if not tasks:
+            return []
+        try:
+            return rq.job.Job.fetch_many([task.id for task in tasks],
+                                         connection=current_app.redis)
+        except redis.exceptions.RedisError:
+            return [None] * len(tasks)
+
+    def to_dict(self, job=None):
+        """
+        Args:
+            job (Job): the rq job of the task, from `get_rq_jobs`.
+
+        Returns:
+            dict: the task with its progress, a finished job or a job that
+                expired from redis counts as 100.
+        """
+        if self.complete or job is None:
+            progress = 100
+        else:
+            progress = job.meta.get('progress', 0)
+        status = job.get_status(refresh=False) if job is not None else None
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'complete': bool(self.complete),
+            'progress': progress,
+            # NOTE: recent versions of rq return a `JobStatus` enum.
+            'status': getattr(status, 'value', status)
+        }
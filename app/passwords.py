@@ -0,0 +1,133 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import hashlib
+import hmac
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.cache import LocalCache
+from app.process_local import ProcessLocal
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the password pool can not take more work right now.
+    """
+
+
+class PasswordHasher(object):
+    """Runs the (deliberately slow) PBKDF2 password hashing on a bounded
+        process pool, so that a burst of logins does not stall the request
+        threads of the worker.
+
+        At most `PASSWORD_POOL_SIZE + PASSWORD_POOL_BACKLOG` checks are in
+        flight per process, anything beyond that raises `PasswordPoolBusy`
+        instead of queueing forever. With `PASSWORD_POOL_SIZE = 0` the hashing
+        runs inline.
+
+        Successful checks are remembered for `PASSWORD_CACHE_TTL` seconds,
+        keyed by an HMAC of the username, the password and the stored hash,
+        so a client logging in repeatedly skips the key derivation.
+    """
+
+    def __init__(self, app=None):
+        self.size = 0
+        self.backlog = 0
+        self.timeout = None
+        self.cache = LocalCache()
+        self.cache_ttl = 0
+        self.secret = b''
+        self._pool = ProcessLocal(self._start_pool)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.size = app.config['PASSWORD_POOL_SIZE']
+        self.backlog = app.config['PASSWORD_POOL_BACKLOG']
+        self.timeout = app.config['PASSWORD_POOL_TIMEOUT']
+        self.cache = LocalCache(app.config['PASSWORD_CACHE_SIZE'])
+        self.cache_ttl = app.config['PASSWORD_CACHE_TTL']
+        self.secret = app.config['SECRET_KEY'].encode('utf-8')
+
+    def _start_pool(self):
+        return (ProcessPoolExecutor(max_workers=self.size),
+                threading.BoundedSemaphore(self.size + self.backlog))
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and wait for the result.
+
+        Raises:
+            PasswordPoolBusy: the pool is saturated or did not answer in time.
+        """
+        if self.size <= 0:
+            return fn(*args)
+        executor, slots = self._pool.get()
+        if not slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda f: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordPoolBusy()
+
+    def map(self, fn, items):
+        """Run `fn` over all the items on the pool, for the bulk operations.
+            A bulk operation takes a single slot and submits `PASSWORD_POOL_SIZE`
+            items at a time, so a login waits for one window at most instead
+            of the whole operation.
+
+        Raises:
+            PasswordPoolBusy: the pool is saturated.
+
+        Returns:
+            list: the results, in the order of the items.
+        """
+        if self.size <= 0:
+            return [fn(item) for item in items]
+        executor, slots = self._pool.get()
+        if not slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        results = []
+        try:
+            for start in range(0, len(items), self.size):
+                futures = [executor.submit(fn, item)
+                           for item in items[start:start + self.size]]
+                results.extend(future.result() for future in futures)
+            return results
+        finally:
+            slots.release()
+
+    def _cache_key(self, username, password, password_hash):
+        message = '\0'.join([username, password, password_hash]).encode('utf-8')
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def check(self, username, password_hash, password):
+        """Verify a password against the stored hash.
+
+        Args:
+            username (string): the owner of the password.
+            password_hash (string): the stored hash.
+            password (string): the password from the request.
+
+        Returns:
+            boolean
+        """
+        if not password_hash:
+            return False
+        key = self._cache_key(username, password, password_hash)
+        if self.cache.get(key):
+            return True
+        result = self.run(check_password_hash, password_hash, password)
+        if result:
+            self.cache.set(key, True, self.cache_ttl)
+        return result
+
+    def generate(self, password):
+        return self.run(generate_password_hash, password)
+
+    def generate_many(self, passwords):
+        return self.map(generate_password_hash, passwords)
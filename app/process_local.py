@@ -0,0 +1,43 @@
+import os
+import threading
+
+
+class ProcessLocal(object):
+    """A value built lazily, once in every process.
+
+        Threads and process pools do not survive a fork: one started before
+        gunicorn forks its workers, or before rq forks a work horse, is not
+        usable by the child. `get()` builds the value again the first time it
+        is called in a new process.
+    """
+
+    def __init__(self, factory):
+        """
+        Args:
+            factory (callable): builds the value, called without arguments.
+        """
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def pop(self):
+        """forgets the value of the current process, the next `get()` builds a
+            new one.
+
+        Returns:
+            object: the value, None when it was not built in this process.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return None
+            value, self._value, self._pid = self._value, None, None
+            return value
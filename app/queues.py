@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from datetime import timezone
+import time
+
+import rq
+from rq.utils import utcparse
+
+
+def queue_key(app, name):
+    """the rq name of a queue. The default queue keeps the `app-tasks` name of
+        the single queue it replaced, so the jobs already enqueued still run.
+    """
+    if name == app.config['TASK_DEFAULT_QUEUE']:
+        return 'app-tasks'
+    return 'app-tasks-' + name
+
+
+def make_queues(app):
+    """builds the rq queues of the `TASK_QUEUES` config.
+
+    Args:
+        app (Flask): the application, with its `redis` connection.
+
+    Returns:
+        OrderedDict: name -> rq.Queue, in priority order.
+    """
+    return OrderedDict(
+        (name, rq.Queue(queue_key(app, name), connection=app.redis))
+        for name in app.config['TASK_QUEUES'])
+
+
+def route_task(app, name, queue=None):
+    """the queue a task is enqueued on.
+
+    Args:
+        app (Flask): the application.
+        name (string): the task name, a function of `app.tasks`.
+        queue (string): overrides the `TASK_ROUTES` config.
+
+    Raises:
+        ValueError: the queue is not one of `TASK_QUEUES`.
+
+    Returns:
+        rq.Queue
+    """
+    queue = queue or app.config['TASK_ROUTES'].get(name) or app.config['TASK_DEFAULT_QUEUE']
+    if queue not in app.task_queues:
+        raise ValueError('unknown task queue: {}'.format(queue))
+    return app.task_queues[queue]
+
+
+def queue_stats(queues):
+    """The numbers needed to size the workers, read with two pipelined redis
+        round trips whatever the number of queues.
+
+    Args:
+        queues (OrderedDict): name -> rq.Queue, see `make_queues`.
+
+    Returns:
+        dict: for every queue, the jobs waiting (`depth`), running (`started`)
+            and failed, and the seconds the oldest waiting job has waited
+            (`latency`, 0 when the queue is empty).
+    """
+    connection = next(iter(queues.values())).connection
+    pipe = connection.pipeline(transaction=False)
+    for queue in queues.values():
+        pipe.llen(queue.key)
+        pipe.lindex(queue.key, 0)
+        pipe.zcard(queue.started_job_registry.key)
+        pipe.zcard(queue.failed_job_registry.key)
+    results = pipe.execute()
+    stats, oldest = OrderedDict(), []
+    for i, name in enumerate(queues):
+        depth, head, started, failed = results[i * 4:i * 4 + 4]
+        stats[name] = {'depth': depth, 'started': started, 'failed': failed,
+                       'latency': 0}
+        if head is not None:
+            oldest.append((name, head.decode('utf-8')))
+    if oldest:
+        pipe = connection.pipeline(transaction=False)
+        for name, job_id in oldest:
+            pipe.hget(rq.job.Job.key_for(job_id), 'enqueued_at')
+        now = time.time()
+        for (name, job_id), enqueued_at in zip(oldest, pipe.execute()):
+            if enqueued_at:
+                enqueued_at = utcparse(enqueued_at.decode('utf-8'))
+                # NOTE: older versions of rq return a naive utc datetime.
+                if enqueued_at.tzinfo is None:
+                    enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+                stats[name]['latency'] = round(max(now - enqueued_at.timestamp(), 0), 3)
+    return stats
@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+import threading
+import time
+
+from flask import has_request_context, request
+from flask_sqlalchemy import BaseQuery, SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import Select
+
+# the requests whose queries may read from a replica.
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class Replicas(object):
+    """The read replicas of `SQLALCHEMY_REPLICA_URIS`, picked round-robin.
+
+        Their engines are created with the options of the primary but are
+        not binds of Flask-SQLAlchemy, `db.create_all()` and the migrations
+        never touch them. A replica whose connection fails (`OperationalError`,
+        disconnects) is ejected for `SQLALCHEMY_REPLICA_COOLDOWN` seconds, the
+        query that failed runs again on the primary (see `RoutingSession.read`).
+        With every replica ejected the reads go to the primary.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.app = None
+        self.db = None
+        self.uris = []
+        self.cooldown = 30
+        self._engines = None
+        self._ejected = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        self.uris = list(app.config['SQLALCHEMY_REPLICA_URIS'])
+        self.cooldown = app.config['SQLALCHEMY_REPLICA_COOLDOWN']
+
+    def _create_engine(self, uri):
+        # the same options as `_EngineConnector.get_options` of Flask-SQLAlchemy.
+        sa_url = make_url(uri)
+        options = {}
+        self.db.apply_pool_defaults(self.app, options)
+        self.db.apply_driver_hacks(self.app, sa_url, options)
+        options.update(self.app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        engine = self.db.create_engine(sa_url, options)
+        event.listen(engine, 'handle_error', self._handle_error)
+        return engine
+
+    def engines(self):
+        # NOTE: created on first use, like the engine of the primary.
+        if self._engines is None:
+            with self._lock:
+                if self._engines is None:
+                    self._engines = [self._create_engine(uri) for uri in self.uris]
+        return self._engines
+
+    def _handle_error(self, context):
+        if context.is_disconnect or \
+                isinstance(context.sqlalchemy_exception, exc.OperationalError):
+            self._ejected[context.engine] = time.time() + self.cooldown
+
+    def is_healthy(self, engine):
+        return self._ejected.get(engine, 0) <= time.time()
+
+    def choose(self):
+        """
+        Returns:
+            Engine: the next healthy replica, None if there is none.
+        """
+        engines = self.engines()
+        with self._lock:
+            for _ in range(len(engines)):
+                engine = engines[self._next % len(engines)]
+                self._next += 1
+                if self.is_healthy(engine):
+                    return engine
+        return None
+
+
+class RoutingSession(SignallingSession):
+    """Sends the reads to a replica and everything else to the primary.
+
+        The reads go to a replica in the `GET`, `HEAD` and `OPTIONS`
+        requests, or inside `db.replica_reads()`, unless `db.primary_reads()`
+        was called. Once the session wrote
+        (a flush, an UPDATE or any statement which is not a plain SELECT) it
+        sticks to the primary until the end of the request, so a request
+        reads its own writes. The session keeps the same replica as long as
+        it is healthy.
+    """
+    # the replica of the last `get_bind`, None for the primary.
+    _replica = None
+
+    def get_bind(self, mapper=None, clause=None):
+        self._replica = None
+        replicas = getattr(self.app, 'replicas', None)
+        if replicas is not None and replicas.uris and self._reads_from_replica(mapper, clause):
+            engine = self.info.get('replica_engine')
+            if engine is None or not replicas.is_healthy(engine):
+                engine = self.info['replica_engine'] = replicas.choose()
+            if engine is not None:
+                self._replica = engine
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def read(self, run, *args, **kwargs):
+        """runs a statement, and runs it again on the primary when it failed
+            on a replica which was ejected for it.
+
+        Args:
+            run (callable): executes the statement, it calls `get_bind`.
+        """
+        self._replica = None
+        try:
+            return run(*args, **kwargs)
+        except exc.DBAPIError:
+            replica = self._replica
+            if replica is None or self.app.replicas.is_healthy(replica):
+                raise
+        previous = self.info.get('replica')
+        self.info['replica'] = False
+        try:
+            return run(*args, **kwargs)
+        finally:
+            self.info['replica'] = previous
+
+    def execute(self, clause, params=None, mapper=None, bind=None, **kw):
+        return self.read(SignallingSession.execute, self, clause, params, mapper, bind, **kw)
+
+    def _reads_from_replica(self, mapper, clause):
+        if self._flushing or self.info.get('wrote'):
+            return False
+        if clause is None:
+            # a connection was asked for, e.g. `session.connection()`.
+            return False
+        if not isinstance(clause, Select) or clause._for_update_arg is not None:
+            self.info['wrote'] = True
+            return False
+        if mapper is not None and mapper.persist_selectable.info.get('bind_key') is not None:
+            return False
+        replica = self.info.get('replica')
+        if replica is None:
+            replica = has_request_context() and request.method in READ_METHODS
+        return replica
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+class RoutingQuery(BaseQuery):
+    """`BaseQuery` whose statements go through `RoutingSession.read`.
+    """
+
+    def _execute_and_instances(self, querycontext):
+        return self.session.read(BaseQuery._execute_and_instances, self, querycontext)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """`SQLAlchemy` with a `RoutingSession` and a `RoutingQuery`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('query_class', RoutingQuery)
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def primary_reads(self):
+        """routes the reads of the rest of the session to the primary,
+            whatever the request method.
+        """
+        self.session().info['replica'] = False
+
+    @contextmanager
+    def replica_reads(self, enabled=True):
+        """routes the reads of the block to a replica, or to the primary with
+            `enabled=False`, whatever the request method.
+        """
+        session = self.session()
+        previous = session.info.get('replica')
+        session.info['replica'] = enabled
+        try:
+            yield session
+        finally:
+            session.info['replica'] = previous
@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import hmac
+import re
+import threading
+import time
+
+import redis
+
+# `<user id>.<expiry>.<generation>.<signature>`, see `SignedTokens.issue`.
+SIGNED_TOKEN_PATTERN = re.compile(r'^\d{1,19}\.\d{1,12}\.\d{1,10}\.[A-Za-z0-9_-]{22}$')
+# the placeholder `SECRET_KEY` of `config.py`, anyone could sign tokens with it.
+DEFAULT_SECRET_KEY = 'you-will-never-guess'
+
+
+class SignedTokens(object):
+    """The access tokens of `TOKEN_MODE = 'signed'`: the user id, the expiry
+        and the token generation of the user, signed with an HMAC of the
+        `SECRET_KEY`. They are verified with pure CPU work, nothing is stored
+        when they are issued.
+
+        `revoke()` records the new generation of a user in the redis hash
+        `token:revoked`, every token of an older generation is rejected. Each
+        process mirrors that hash in memory and only checks the version
+        counter `token:revoked:version` every `TOKEN_REVOCATION_REFRESH`
+        seconds, so a revocation reaches the other processes within that
+        delay. An entry is dropped once `TOKEN_MAX_AGE` seconds have passed,
+        all the tokens it revoked have expired by then.
+
+        NOTE: the revocations live in redis only (the generation in the user
+        table is only used to issue the tokens), a flushed redis lets the
+        revoked tokens through until they expire.
+    """
+    key = 'token:revoked'
+    version_key = 'token:revoked:version'
+
+    def __init__(self, app=None):
+        self.redis = None
+        self.secret = b''
+        self.max_age = 86400
+        self.refresh_interval = 5
+        self._revoked = {}
+        self._version = None
+        self._next_refresh = 0
+        self._refresh_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['TOKEN_MODE'] == 'signed' and \
+                app.config['SECRET_KEY'] in (None, '', DEFAULT_SECRET_KEY):
+            raise RuntimeError('TOKEN_MODE is signed, but SECRET_KEY is not set')
+        self.redis = app.redis
+        self.secret = hashlib.sha256(
+            b'access-token:' + app.config['SECRET_KEY'].encode('utf-8')).digest()
+        self.max_age = app.config['TOKEN_MAX_AGE']
+        self.refresh_interval = app.config['TOKEN_REVOCATION_REFRESH']
+
+    def _sign(self, payload):
+        digest = hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode('ascii')
+
+    def issue(self, user_id, generation, expires_in=3600):
+        """
+        Args:
+            user_id (int): the owner of the token.
+            generation (int): the current token generation of the user.
+            expires_in (int): seconds, at most `TOKEN_MAX_AGE`.
+
+        Returns:
+            string: the token.
+        """
+        # NOTE: a revocation whose database commit failed still applies.
+        generation = max(generation, self.revoked_generation(user_id))
+        expires_at = int(time.time()) + min(expires_in, self.max_age)
+        payload = '{}.{}.{}'.format(user_id, expires_at, generation)
+        return payload + '.' + self._sign(payload)
+
+    def verify(self, token):
+        """
+        Args:
+            token (string): the bearer token from the request.
+
+        Returns:
+            int: the id of the user, None if the token is invalid, expired or
+                revoked.
+        """
+        if SIGNED_TOKEN_PATTERN.match(token) is None:
+            return None
+        payload, signature = token.rsplit('.', 1)
+        if not hmac.compare_digest(self._sign(payload), signature):
+            return None
+        user_id, expires_at, generation = (int(part) for part in payload.split('.'))
+        if expires_at <= time.time():
+            return None
+        if generation < self.revoked_generation(user_id):
+            return None
+        return user_id
+
+    def revoked_generation(self, user_id):
+        """
+        Returns:
+            int: the tokens of the user older than this generation are revoked.
+        """
+        if time.time() >= self._next_refresh:
+            self._refresh()
+        return self._revoked.get(user_id, 0)
+
+    def revoke(self, user_id, generation):
+        """Reject the tokens of the user older than `generation`.
+
+        NOTE: a redis error is raised, the revocation must not be lost silently.
+        """
+        until = int(time.time()) + self.max_age
+        self._revoked[user_id] = max(self._revoked.get(user_id, 0), generation)
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key, user_id, '{}:{}'.format(generation, until))
+        pipe.incr(self.version_key)
+        pipe.execute()
+
+    def _refresh(self):
+        # only one thread refreshes, the others keep using the current mirror.
+        if not self._refresh_lock.acquire(False):
+            return
+        try:
+            now = time.time()
+            self._next_refresh = now + self.refresh_interval
+            try:
+                version = self.redis.get(self.version_key)
+                if version is not None and version == self._version:
+                    return
+                raw = self.redis.hgetall(self.key)
+            except redis.exceptions.RedisError:
+                return
+            revoked, expired = {}, []
+            for field, value in raw.items():
+                generation, until = value.decode('utf-8').split(':')
+                if int(until) <= now:
+                    expired.append(field)
+                else:
+                    revoked[int(field)] = int(generation)
+            if expired:
+                try:
+                    self.redis.hdel(self.key, *expired)
+                except redis.exceptions.RedisError:
+                    pass
+            self._revoked, self._version = revoked, version
+        finally:
+            self._refresh_lock.release()
@@ -1,25 +1,83 @@
-from app import create_app
+import time
 
+from flask import current_app, has_app_context
 from rq import get_current_job
-from app import db
+from app import create_app, db
 from app.models import Task
 
-# needs to create its own application instance if the task functions need it.
-app = create_app()
-# pushing a context makes the application be the "current" application instance
-app.app_context().push()
+# NOTE: importing this module has no side effects. `worker.py` builds the
+# application once in the parent process, before rq forks the work horses.
+_app = None
 
 
-def _set_task_progress(progress):
+def _get_app():
+    """the application of the tasks, the one of `worker.py` when it runs them.
+        A worker started with the plain `rq worker` command has none, the
+        application is then built on the first use, once per process.
+
+    Returns:
+        Flask: the application, its context is pushed.
+    """
+    global _app
+    if has_app_context():
+        return current_app._get_current_object()
+    if _app is None:
+        _app = create_app()
+        # pushing a context makes the application be the "current" application instance
+        _app.app_context().push()
+    return _app
+
+
+def _release_inflight(job, connection, *args, **kwargs):
+    """the rq callback of every job of `User.launch_task`, however it ends
+        (success, failure or stop): lets the user launch the task again.
+    """
+    if job.args:
+        _get_app().inflight_tasks.release(job.args[0], job.func_name.rsplit('.', 1)[-1],
+                                          job.id)
+
+# the last progress written for each running job: job id -> (time, progress)
+_last_progress = {}
+
+
+def _set_task_progress(progress, interval=None, step=None):
+    """report the progress of the current job, it is safe to call it in a tight loop.
+        The intermediate progress only goes to the job meta in redis, and at most
+        once every `interval` milliseconds unless it moved by `step` percent.
+        The SQL `Task` row is only written once, on completion.
+        Every write is also published to the clients of `GET /api/tasks/stream`.
+
+    Args:
+        progress (int): from 0 to 100.
+        interval (int): milliseconds, defaults to the `TASK_PROGRESS_INTERVAL` config.
+        step (int): percent, defaults to the `TASK_PROGRESS_STEP` config.
+    """
     job = get_current_job()
-    if job:
-        job.meta['progress'] = progress
-        job.save_meta()
+    if not job:
+        return
+    app = _get_app()
+    if interval is None:
+        interval = app.config['TASK_PROGRESS_INTERVAL']
+    if step is None:
+        step = app.config['TASK_PROGRESS_STEP']
+    now = time.time()
+    last = _last_progress.get(job.id)
+    if progress < 100 and last is not None:
+        last_time, last_progress = last
+        if (now - last_time) * 1000 < interval and progress - last_progress < step:
+            return
+    job.meta['progress'] = progress
+    job.save_meta()
+    if progress >= 100:
+        _last_progress.pop(job.id, None)
         # get task from db
-        task = Task.query.get(job.get_id())
-        # push notifications to the client
-        # task.user.add_notification('task_progress', {'task_id': job.get_id(),
-        #                                              'progress': progress})
-        if progress >= 100:
-            task.complete = True
+        task = Task.query.get(job.id)
+        task.complete = True
         db.session.commit()
+    else:
+        _last_progress[job.id] = (now, progress)
+    # push notifications to the client, `User.launch_task` passes the user id
+    # as the first argument of every task.
+    if job.args:
+        app.task_events.publish(job.args[0], {'id': job.id, 'progress': progress,
+                                              'complete': progress >= 100})
@@ -0,0 +1,366 @@
+"""Load benchmark of the API hot paths.
+
+    $ python benchmarks/api.py [--users 1000] [--followers 10] [--requests 300]
+                               [--processes 4] [--output run.json]
+    $ python benchmarks/api.py --compare before.json after.json
+    $ python benchmarks/api.py --compare-metrics [--users 1000] [...]
+
+It runs offline: the database is a temporary SQLite file seeded with `--users`
+users following `--followers` users each, and redis is an in-process
+`fakeredis` server. Without fakeredis, redis points at a closed port and the
+numbers are those of the degraded (uncached) paths.
+
+Every scenario is driven twice:
+
+- `test_client`: one thread through the Flask test client, which also counts
+  the SQL statements per request.
+- `wsgi`: `--processes` client processes sending real HTTP requests to a
+  threaded WSGI server.
+
+The result is printed (and written to `--output`) as json, with the throughput,
+the p50/p99 latencies and the queries per request of every scenario. Any
+failed request makes the run exit with an error, the report is not written
+then.
+
+`--compare-metrics` runs the benchmark with `METRICS_ENABLED=0` and then `1`,
+each in a fresh process (`app.metrics` instruments every engine once imported),
+and compares the two runs: the overhead of the request metrics.
+"""
+import argparse
+import base64
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ('post_tokens', 'get_user', 'get_users_deep_page', 'post_users')
+PASSWORD = 'benchmark-password'
+# NOTE: the server and the clients are forked, they inherit the seeded
+# application and the fake redis.
+FORK = multiprocessing.get_context('fork')
+
+
+def configure(workdir):
+    """points the application at a temporary database and a fake redis, it
+        must run before the application is created.
+
+    Returns:
+        string: 'fakeredis', or 'none' when it is not installed.
+    """
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key')
+    try:
+        import fakeredis
+    except ImportError:
+        # nothing listens on port 1, every redis call fails fast.
+        os.environ['REDIS_URL'] = 'redis://127.0.0.1:1/0'
+        return 'none'
+    import redis
+    server = fakeredis.FakeServer()
+    # NOTE: keeps the class of the client, `app.metrics.InstrumentedRedis`
+    # counts the commands.
+    redis.Redis.from_url = classmethod(
+        lambda cls, url, **kwargs: cls(connection_pool=fakeredis.FakeRedis(
+            server=server).connection_pool))
+    return 'fakeredis'
+
+
+def seed(app, users, followers):
+    """inserts the users and the follower graph with bulk statements, every
+        user follows the `followers` next ones and has as many followers.
+    """
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import User, followers as followers_table
+    with app.app_context():
+        db.create_all()
+        password_hash = generate_password_hash(PASSWORD)
+        follows = min(followers, users - 1)
+        db.session.execute(User.__table__.insert(), [{
+            'id': i, 'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i),
+            'password_hash': password_hash, 'follower_count': follows,
+            'followed_count': follows} for i in range(1, users + 1)])
+        db.session.execute(followers_table.insert(), [{
+            'follower_id': i, 'followed_id': (i + k - 1) % users + 1}
+            for i in range(1, users + 1) for k in range(1, follows + 1)])
+        db.session.commit()
+
+
+def basic_auth(username):
+    credentials = '{}:{}'.format(username, PASSWORD).encode('utf-8')
+    return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+
+def make_requests(scenario, count, users, tokens, per_page, prefix):
+    """
+    Returns:
+        list: (method, url, headers, body) of the requests of the scenario.
+    """
+    # NOTE: the drivers do not share a sequence, the second one would only hit
+    # the password cache warmed up by the first one.
+    rng = random.Random(scenario + prefix)
+    last_page = max((users + per_page - 1) // per_page, 1)
+    requests = []
+    for i in range(count):
+        if scenario == 'post_tokens':
+            username = 'user{}'.format(rng.randint(1, users))
+            requests.append(('POST', '/api/tokens',
+                             {'Authorization': basic_auth(username)}, None))
+        elif scenario == 'get_user':
+            requests.append(('GET', '/api/users/{}'.format(rng.randint(1, users)),
+                             {'Authorization': 'Bearer ' + rng.choice(tokens)}, None))
+        elif scenario == 'get_users_deep_page':
+            page = rng.randint(max(last_page - 10, 1), last_page)
+            requests.append(('GET', '/api/users?page={}&per_page={}'.format(page, per_page),
+                             {'Authorization': 'Bearer ' + rng.choice(tokens)}, None))
+        elif scenario == 'post_users':
+            username = '{}-{}'.format(prefix, i)
+            body = json.dumps({'username': username, 'email': username + '@example.com',
+                               'password': PASSWORD})
+            requests.append(('POST', '/api/users',
+                             {'Content-Type': 'application/json'}, body))
+    return requests
+
+
+def summarize(latencies, seconds, queries=None):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    result = {
+        'requests': n,
+        'seconds': round(seconds, 3),
+        'throughput': round(n / seconds, 1) if seconds else None,
+        'p50_ms': round(latencies[int(0.50 * (n - 1))] * 1000, 2),
+        'p99_ms': round(latencies[int(0.99 * (n - 1))] * 1000, 2),
+    }
+    if queries is not None:
+        result['queries_per_request'] = round(queries / n, 2)
+    return result
+
+
+def run_test_client(app, requests):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    client = app.test_client()
+    queries = [0]
+
+    def count(*args):
+        queries[0] += 1
+
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        latencies, errors = [], 0
+        start = time.perf_counter()
+        for method, url, headers, body in requests:
+            began = time.perf_counter()
+            response = client.open(url, method=method, headers=headers, data=body)
+            latencies.append(time.perf_counter() - began)
+            errors += response.status_code >= 400
+        seconds = time.perf_counter() - start
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    result = summarize(latencies, seconds, queries[0])
+    result['errors'] = errors
+    return result
+
+
+def _serve(app, port):
+    import logging
+    import signal
+    from werkzeug.serving import make_server
+    # no access log.
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # `terminate()` sends SIGTERM, the processes of the password pool must
+    # not outlive the server.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+    finally:
+        for child in multiprocessing.active_children():
+            child.terminate()
+
+
+def _drive(args):
+    port, requests = args
+    latencies, errors = [], 0
+    for method, url, headers, body in requests:
+        began = time.perf_counter()
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        connection.request(method, url, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        latencies.append(time.perf_counter() - began)
+        errors += response.status >= 400
+    return latencies, errors
+
+
+def run_wsgi(port, requests, processes):
+    chunks = [(port, requests[i::processes]) for i in range(processes)]
+    with FORK.Pool(processes) as pool:
+        start = time.perf_counter()
+        results = pool.map(_drive, chunks)
+        seconds = time.perf_counter() - start
+    latencies = [latency for chunk, _ in results for latency in chunk]
+    result = summarize(latencies, seconds)
+    result['errors'] = sum(errors for _, errors in results)
+    return result
+
+
+def wait_for(port, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/api/users/1')
+            connection.getresponse().read()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def benchmark(args):
+    workdir = tempfile.mkdtemp()
+    # the log files of `create_app` go to the temporary directory.
+    os.chdir(workdir)
+    redis_backend = configure(workdir)
+    from app import create_app
+    app = create_app()
+    seed(app, args.users, args.followers)
+    client = app.test_client()
+    tokens = []
+    for i in range(1, min(args.users, 50) + 1):
+        response = client.post('/api/tokens',
+                               headers={'Authorization': basic_auth('user{}'.format(i))})
+        tokens.append(response.get_json()['token'])
+
+    report = {
+        'config': {'users': args.users, 'followers': args.followers,
+                   'requests': args.requests, 'processes': args.processes,
+                   'per_page': args.per_page, 'redis': redis_backend,
+                   'json_provider': app.json_provider.name,
+                   'metrics': app.config['METRICS_ENABLED'],
+                   'python': platform.python_version()},
+        'test_client': {}, 'wsgi': {}}
+    for scenario in SCENARIOS:
+        warmup = make_requests(scenario, 20, args.users, tokens, args.per_page, 'warmup-tc')
+        run_test_client(app, warmup)
+        requests = make_requests(scenario, args.requests, args.users, tokens,
+                                 args.per_page, 'tc')
+        report['test_client'][scenario] = run_test_client(app, requests)
+
+    if args.processes > 0:
+        port = free_port()
+        # NOTE: not a daemon, a daemonic process can not start the pool of
+        # `app.password_hasher`. It is terminated below.
+        server = FORK.Process(target=_serve, args=(app, port))
+        server.start()
+        try:
+            wait_for(port)
+            for scenario in SCENARIOS:
+                requests = make_requests(scenario, args.requests, args.users, tokens,
+                                         args.per_page, 'wsgi')
+                report['wsgi'][scenario] = run_wsgi(port, requests, args.processes)
+        finally:
+            server.terminate()
+            server.join()
+    return report
+
+
+def compare(before, after):
+    """prints the relative change of every number between two runs.
+    """
+    with open(before) as f:
+        before = json.load(f)
+    with open(after) as f:
+        after = json.load(f)
+    for driver in ('test_client', 'wsgi'):
+        for scenario, numbers in sorted(after.get(driver, {}).items()):
+            old = before.get(driver, {}).get(scenario)
+            if old is None:
+                continue
+            changes = []
+            for name in ('throughput', 'p50_ms', 'p99_ms', 'queries_per_request'):
+                if old.get(name) and numbers.get(name) is not None:
+                    changes.append('{} {} -> {} ({:+.1f}%)'.format(
+                        name, old[name], numbers[name],
+                        (numbers[name] - old[name]) / old[name] * 100))
+            print('{:<12} {:<20} {}'.format(driver, scenario, ', '.join(changes)))
+
+
+def compare_metrics(args):
+    """runs the benchmark without and with `METRICS_ENABLED`, in two new
+        processes, and compares them.
+    """
+    workdir = tempfile.mkdtemp()
+    reports = []
+    for enabled in ('0', '1'):
+        output = os.path.join(workdir, 'metrics-{}.json'.format(enabled))
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        '--users', str(args.users), '--followers', str(args.followers),
+                        '--requests', str(args.requests), '--processes', str(args.processes),
+                        '--per-page', str(args.per_page), '--output', output],
+                       env=dict(os.environ, METRICS_ENABLED=enabled),
+                       stdout=subprocess.DEVNULL, check=True)
+        reports.append(output)
+    print('METRICS_ENABLED=0 -> METRICS_ENABLED=1')
+    compare(*reports)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--followers', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=300,
+                        help='requests per scenario and driver')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='client processes of the WSGI driver, 0 skips it')
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--output', help='write the json report to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two json reports instead of running')
+    parser.add_argument('--compare-metrics', action='store_true',
+                        help='compare runs without and with METRICS_ENABLED')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.compare_metrics:
+        compare_metrics(args)
+        return
+    output = os.path.abspath(args.output) if args.output else None
+    report = benchmark(args)
+    failed = ['{} {}'.format(driver, scenario)
+              for driver in ('test_client', 'wsgi')
+              for scenario, numbers in sorted(report[driver].items()) if numbers['errors']]
+    text = json.dumps(report, indent=2)
+    print(text)
+    # the numbers of failed requests are meaningless, they are not saved.
+    if failed:
+        sys.exit('requests failed in: {}'.format(', '.join(failed)))
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Micro-benchmark of the json providers on a 100-item user page.
+
+    $ python benchmarks/json_encoding.py [--number 2000]
+
+It needs neither a database nor redis, the page is built in memory with the
+same shape as `GET /api/users?per_page=100&fields=id,username,last_seen,_links`.
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from app.json_provider import OrjsonJSONProvider, StdlibJSONProvider, orjson
+from config import Config
+
+
+def user_page(per_page=100):
+    now = datetime.utcnow()
+    items = [{
+        'id': i,
+        'username': 'user{}'.format(i),
+        'last_seen': now - timedelta(minutes=i),
+        '_links': {'self': '/api/users/{}'.format(i)}
+    } for i in range(1, per_page + 1)]
+    return {
+        'items': items,
+        '_meta': {'page': 1, 'per_page': per_page, 'total_pages': 10,
+                  'total_items': 10 * per_page, 'count': 'exact'},
+        '_links': {'self': '/api/users?page=1&per_page=100',
+                   'next': '/api/users?page=2&per_page=100', 'prev': None}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    page = user_page()
+    providers = [StdlibJSONProvider(app)]
+    if orjson is not None:
+        providers.append(OrjsonJSONProvider(app))
+    else:
+        print('orjson is not installed, only the stdlib provider is measured.')
+    for compact in (True, False):
+        app.config['JSON_COMPACT'] = compact
+        for provider in providers:
+            seconds = timeit.timeit(lambda: provider.dumps(page), number=args.number)
+            print('{:<8} compact={!s:<5} {:>8.1f} us/page  {:>6} bytes'.format(
+                provider.name, compact, seconds / args.number * 1e6,
+                len(provider.dumps(page))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Micro-benchmark of the bearer token verification, for both `TOKEN_MODE`s.
+
+    $ python benchmarks/token_verification.py [--number 5000]
+
+It times `app.api.auth.verify_token` in a request context, with a new session
+every call as in a request:
+
+- opaque, local cache: the token is in the in-process tier of the token cache.
+- opaque, redis cache: the local tier is cleared before every call.
+- opaque, database: both tiers are cleared, `User.check_token` runs a query.
+- signed: the signature and the revocation mirror are checked.
+
+The last two lines time the token check alone, without attaching the user to
+the session.
+
+Like `benchmarks/api.py`, it runs on SQLite and fakeredis.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+from api import ROOT, basic_auth, configure, seed  # noqa: F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    redis_backend = configure(workdir)
+    from app import create_app, db
+    from app.api.auth import verify_token
+    app = create_app()
+    seed(app, 10, 1)
+    client = app.test_client()
+
+    def get_token(mode):
+        app.config['TOKEN_MODE'] = mode
+        response = client.post('/api/tokens', headers={'Authorization': basic_auth('user1')})
+        return response.get_json()['token']
+
+    opaque, signed = get_token('opaque'), get_token('signed')
+    cache = app.token_cache
+    key = cache._key(opaque)
+
+    def clear_local():
+        cache.local.delete(key)
+
+    def clear_all():
+        # not `invalidate()`, which would reject the token.
+        cache.local.delete(key)
+        cache.redis.delete(key)
+
+    cases = [
+        ('opaque, local cache', 'opaque', opaque, None),
+        ('opaque, redis cache', 'opaque', opaque, clear_local),
+        ('opaque, database', 'opaque', opaque, clear_all),
+        ('signed', 'signed', signed, None),
+    ]
+    print('redis: {}, {} verifications per case'.format(redis_backend, args.number))
+    with app.test_request_context('/api/users/1'):
+        for name, mode, token, before in cases:
+            app.config['TOKEN_MODE'] = mode
+            assert verify_token(token) is not None, name
+
+            def run():
+                if before is not None:
+                    before()
+                verify_token(token)
+                # a new session, as for every request.
+                db.session.remove()
+
+            seconds = timeit.timeit(run, number=args.number)
+            print('{:<22} {:>8.1f} us/token'.format(name, seconds / args.number * 1e6))
+        # without attaching the user to the session, which both modes share.
+        for name, check in (('cache lookup only', lambda: cache.get(opaque)),
+                            ('signature only', lambda: app.signed_tokens.verify(signed))):
+            seconds = timeit.timeit(check, number=args.number)
+            print('{:<22} {:>8.1f} us/token'.format(name, seconds / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
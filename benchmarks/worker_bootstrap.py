@@ -0,0 +1,88 @@
+"""Benchmark of the rq worker bootstrap.
+
+    $ python benchmarks/worker_bootstrap.py [--number 20]
+
+`cold start` is the time to `import app.tasks` in a fresh interpreter.
+`per job` is the time to fork a work horse (like rq does for every job), run
+a job touching the database and exit:
+
+- `fresh`: a plain `rq worker`, the parent never imported the tasks.
+- `preloaded`: `worker.py`, the parent built the application before forking.
+
+It needs no redis, the database is a temporary SQLite file.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def cold_start(number, env, cwd):
+    timings = []
+    for _ in range(number):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'import app.tasks'], env=env, cwd=cwd)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_job():
+    import app.tasks as tasks
+    from app import db
+    if hasattr(tasks, '_get_app'):
+        tasks._get_app()
+    db.session.execute('SELECT 1')
+    db.session.remove()
+
+
+def per_job(number):
+    timings = []
+    for _ in range(number):
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_job()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def preload():
+    import worker
+    if hasattr(worker, 'bootstrap'):
+        return worker.bootstrap()
+    return worker.app
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return {'mean_ms': round(sum(timings) / len(timings) * 1000, 1),
+            'p50_ms': round(timings[len(timings) // 2] * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    cwd = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(cwd, 'bench.db')
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # the log files of `create_app` go to the temporary directory.
+    os.chdir(cwd)
+    print('cold start     ', summary(cold_start(args.number, env, cwd)))
+    print('per job (fresh)', summary(per_job(args.number)))
+    preload()
+    print('per job (preloaded)', summary(per_job(args.number)))
+
+
+if __name__ == '__main__':
+    main()
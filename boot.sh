@@ -2,4 +2,4 @@
 source venv/bin/activate
 flask db upgrade
 
-exec gunicorn -b :5000 --access-logfile - --error-logfile - start:app
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py -b :5000 -k gevent --access-logfile - --error-logfile - start:app
\ No newline at end of file
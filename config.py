@@ -3,11 +3,113 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
     # ...
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # read replicas, comma separated database URLs, see `app.replicas`.
+    SQLALCHEMY_REPLICA_URIS = [uri.strip() for uri in
+                               (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',')
+                               if uri.strip()]
+    # seconds a failing replica is left out.
+    SQLALCHEMY_REPLICA_COOLDOWN = int(os.environ.get('DATABASE_REPLICA_COOLDOWN') or 30)
+    # seconds the versioned reads of a resource stay on the primary after a
+    # write, it must cover the lag of the replicas, see `ResourceVersions`.
+    SQLALCHEMY_REPLICA_LAG = float(os.environ.get('DATABASE_REPLICA_LAG') or 5)
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
 
+    # 'opaque' tokens are stored in the user table, 'signed' tokens are
+    # verified without any lookup, see `app.signed_tokens.SignedTokens`. The
+    # 'signed' mode refuses to start without a SECRET_KEY of your own.
+    TOKEN_MODE = os.environ.get('TOKEN_MODE') or 'opaque'
+    TOKEN_MAX_AGE = int(os.environ.get('TOKEN_MAX_AGE') or 86400)
+    TOKEN_REVOCATION_REFRESH = int(os.environ.get('TOKEN_REVOCATION_REFRESH') or 5)
+
+    # bearer token cache, see `app.cache.TokenCache`
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 1024)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL') or 300)
+    TOKEN_CACHE_LOCAL_TTL = int(os.environ.get('TOKEN_CACHE_LOCAL_TTL') or 10)
+    TOKEN_CACHE_NEGATIVE_TTL = int(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL') or 30)
+    # how often a process drops the tokens invalidated by the others.
+    TOKEN_CACHE_SYNC_INTERVAL = float(os.environ.get('TOKEN_CACHE_SYNC_INTERVAL') or 1)
+
+    # password hashing pool, see `app.passwords.PasswordHasher`
+    PASSWORD_POOL_SIZE = int(os.environ.get('PASSWORD_POOL_SIZE') or 2)
+    PASSWORD_POOL_BACKLOG = int(os.environ.get('PASSWORD_POOL_BACKLOG') or 4)
+    PASSWORD_POOL_TIMEOUT = float(os.environ.get('PASSWORD_POOL_TIMEOUT') or 5)
+    PASSWORD_CACHE_SIZE = int(os.environ.get('PASSWORD_CACHE_SIZE') or 1024)
+    PASSWORD_CACHE_TTL = int(os.environ.get('PASSWORD_CACHE_TTL') or 60)
+
+    # how `to_collection_dict` counts the items: 'exact', 'cached' or 'none'
+    API_COUNT_MODE = os.environ.get('API_COUNT_MODE') or 'cached'
+    API_COUNT_CACHE_TTL = int(os.environ.get('API_COUNT_CACHE_TTL') or 60)
+    # seconds the version counters of the ETags live without a write.
+    API_VERSION_TTL = int(os.environ.get('API_VERSION_TTL') or 86400)
+    # cache the rendered collection pages, 0 disables it.
+    API_RESPONSE_CACHE_TTL = int(os.environ.get('API_RESPONSE_CACHE_TTL') or 0)
+    # the most users `GET /api/users?ids=` resolves at once.
+    API_BATCH_LIMIT = int(os.environ.get('API_BATCH_LIMIT') or 100)
+    # the most users followed, unfollowed or probed by one `/api/follows` request.
+    API_FOLLOW_BATCH_LIMIT = int(os.environ.get('API_FOLLOW_BATCH_LIMIT') or 1000)
+    # rows fetched per round trip by the streaming export.
+    API_EXPORT_BATCH_SIZE = int(os.environ.get('API_EXPORT_BATCH_SIZE') or 1000)
+    # `POST /api/users/bulk` takes at most API_BULK_LIMIT users, and checks and
+    # inserts them API_BULK_CHUNK_SIZE at a time.
+    API_BULK_LIMIT = int(os.environ.get('API_BULK_LIMIT') or 50000)
+    API_BULK_CHUNK_SIZE = int(os.environ.get('API_BULK_CHUNK_SIZE') or 500)
+
+    # the rq queues in priority order, a worker started by `worker.py` empties
+    # the first one before taking jobs from the next one.
+    TASK_QUEUES = (os.environ.get('TASK_QUEUES') or 'high,default,bulk').split(',')
+    TASK_DEFAULT_QUEUE = os.environ.get('TASK_DEFAULT_QUEUE') or 'default'
+    # task name -> queue, `User.launch_task` can still override it.
+    # e.g. {'export_posts': 'bulk'}
+    TASK_ROUTES = {}
+
+    # the progress of a task is written at most every TASK_PROGRESS_INTERVAL
+    # milliseconds, unless it moved by TASK_PROGRESS_STEP percent.
+    TASK_PROGRESS_INTERVAL = int(os.environ.get('TASK_PROGRESS_INTERVAL') or 500)
+    TASK_PROGRESS_STEP = int(os.environ.get('TASK_PROGRESS_STEP') or 5)
+    # a launched task can not be launched again by the same user until it
+    # completes, or at most TASK_INFLIGHT_TTL seconds when it crashed.
+    TASK_INFLIGHT_TTL = int(os.environ.get('TASK_INFLIGHT_TTL') or 3600)
+    # `GET /api/tasks/stream`: a comment is sent every SSE_HEARTBEAT seconds to
+    # keep the connection open, and the stream is closed after SSE_MAX_DURATION
+    # seconds, the client reconnects after SSE_RETRY milliseconds.
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT') or 15)
+    SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION') or 300)
+    SSE_RETRY = int(os.environ.get('SSE_RETRY') or 3000)
+    SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE') or 100)
+
+    # request metrics at `/metrics`, see `app.metrics.Metrics`. With
+    # METRICS_TOKEN set, the scraper must send it as a bearer token.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING') == '1'
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL') or 10)
+    # the upper bounds of the latency histogram, in seconds.
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    # json logs, see `app.log`. Every process writes to its own file in
+    # LOG_DIR, unless LOG_TO_STDOUT is set. Only a LOG_SAMPLE_RATE fraction of
+    # the records below WARNING is kept.
+    LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
+    LOG_DIR = os.environ.get('LOG_DIR') or 'logs'
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES') or 10 * 1024 * 1024)
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 10)
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE') or 10000)
+    LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE') or 1)
+    # the name of the log file of the process, its pid when not set. Only the
+    # processes which never write at the same time may share one: the gunicorn
+    # workers get a slot number (see `gunicorn.conf.py`), `worker.py` gives its
+    # work horses the file of their worker.
+    LOG_FILE_ID = os.environ.get('LOG_FILE_ID')
+
+    # json encoding of the API, 'auto' uses orjson when it is installed.
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER') or 'auto'
+    # 1 for compact output, 0 for pretty printed, unset follows Flask.
+    JSON_COMPACT = {'1': True, '0': False}.get(os.environ.get('JSON_COMPACT'))
+
 class DevelopmentConfig(Config):
     pass
 
@@ -0,0 +1,24 @@
+"""gunicorn settings, loaded with `gunicorn -c gunicorn.conf.py start:app`.
+
+Every worker takes the lowest slot number that no live worker holds, and logs
+to `application.web-<slot>.log` (see `app.log`). A restarted worker then goes
+on with the file of the one it replaces, instead of leaving a new file behind
+for every pid.
+"""
+import itertools
+import os
+
+
+def pre_fork(server, worker):
+    # runs in the arbiter, which knows the live workers.
+    taken = {getattr(live, 'log_slot', None) for live in server.WORKERS.values()}
+    worker.log_slot = next(slot for slot in itertools.count() if slot not in taken)
+
+
+def post_fork(server, worker):
+    log_file_id = 'web-{}'.format(worker.log_slot)
+    os.environ['LOG_FILE_ID'] = log_file_id
+    # with `--preload` the application was created before the fork.
+    app = getattr(server.app, 'callable', None)
+    if app is not None:
+        app.config['LOG_FILE_ID'] = log_file_id
@@ -0,0 +1,75 @@
+"""followers primary key, reverse index and follow counts
+
+Revision ID: 3f1c2b7a9d10
+Revises: 8ff03e196315
+Create Date: 2026-10-18 15:02:11.204318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2b7a9d10'
+down_revision = '8ff03e196315'
+branch_labels = None
+depends_on = None
+
+
+def _deduplicate_followers():
+    # the table had no key, it may hold the same pair twice or NULL halves,
+    # which the primary key refuses. It is rebuilt from its distinct pairs.
+    followers = sa.table('followers', sa.column('follower_id'), sa.column('followed_id'))
+    pairs = sa.select([followers.c.follower_id, followers.c.followed_id]) \
+        .group_by(followers.c.follower_id, followers.c.followed_id) \
+        .having(sa.func.count() > 1).alias('pairs')
+    connection = op.get_bind()
+    duplicates = connection.execute(sa.select([sa.func.count()]).select_from(pairs)).scalar()
+    nulls = connection.execute(sa.select([sa.func.count()]).select_from(followers).where(
+        sa.or_(followers.c.follower_id.is_(None), followers.c.followed_id.is_(None)))).scalar()
+    if not duplicates and not nulls:
+        return
+    op.execute('CREATE TABLE followers_distinct AS '
+               'SELECT DISTINCT follower_id, followed_id FROM followers '
+               'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL')
+    op.execute(followers.delete())
+    op.execute('INSERT INTO followers (follower_id, followed_id) '
+               'SELECT follower_id, followed_id FROM followers_distinct')
+    op.execute('DROP TABLE followers_distinct')
+
+
+def upgrade():
+    _deduplicate_followers()
+    # NOTE: batch mode lets SQLite recreate the tables, it has no ALTER for
+    # primary keys.
+    with op.batch_alter_table('followers') as batch_op:
+        batch_op.alter_column('follower_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('followed_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('pk_followers', ['follower_id', 'followed_id'])
+        batch_op.create_index('ix_followers_followed_id_follower_id',
+                              ['followed_id', 'follower_id'], unique=False)
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0',
+                                      nullable=False))
+        batch_op.add_column(sa.Column('followed_count', sa.Integer(), server_default='0',
+                                      nullable=False))
+
+    user = sa.table('user', sa.column('id'), sa.column('follower_count'),
+                    sa.column('followed_count'))
+    followers = sa.table('followers', sa.column('follower_id'), sa.column('followed_id'))
+    op.execute(user.update().values(
+        follower_count=sa.select([sa.func.count()])
+        .where(followers.c.followed_id == user.c.id).as_scalar(),
+        followed_count=sa.select([sa.func.count()])
+        .where(followers.c.follower_id == user.c.id).as_scalar()))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('followed_count')
+        batch_op.drop_column('follower_count')
+    with op.batch_alter_table('followers') as batch_op:
+        batch_op.drop_index('ix_followers_followed_id_follower_id')
+        batch_op.drop_constraint('pk_followers', type_='primary')
+        batch_op.alter_column('followed_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('follower_id', existing_type=sa.Integer(), nullable=True)
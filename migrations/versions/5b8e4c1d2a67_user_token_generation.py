@@ -0,0 +1,27 @@
+"""user token generation
+
+Revision ID: 5b8e4c1d2a67
+Revises: 3f1c2b7a9d10
+Create Date: 2026-10-18 15:20:43.118604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e4c1d2a67'
+down_revision = '3f1c2b7a9d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('token_generation', sa.Integer(), server_default='0',
+                                      nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('token_generation')
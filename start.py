@@ -10,3 +10,13 @@ def make_flask_shell_context():
         Run `flask shell` command to get into shell and no need to import all the dependencies one by one.
     """
     return {'db': db, 'User': User, 'Task': Task}
+
+
+@app.cli.command('queue-stats')
+def queue_stats_command():
+    """print the depth and the latency of every task queue, as json.
+        Use it to size the workers of every queue.
+    """
+    import json
+    from app.queues import queue_stats
+    print(json.dumps(queue_stats(app.task_queues), indent=2))
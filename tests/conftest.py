@@ -0,0 +1,56 @@
+import shutil
+
+import pytest
+import redis
+
+from app import create_app, db
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """an application on two SQLite files, `primary.db` and its replica
+        `replica.db` which starts as a copy of the empty schema, and a fake
+        redis.
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    # NOTE: keeps the class of the client, `app.metrics.InstrumentedRedis`.
+    monkeypatch.setattr(redis.Redis, 'from_url', classmethod(
+        lambda cls, url, **kwargs: cls(connection_pool=fakeredis.FakeRedis(
+            server=server).connection_pool)))
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI',
+                        'sqlite:///' + str(tmp_path / 'primary.db'))
+    monkeypatch.setattr(Config, 'SQLALCHEMY_REPLICA_URIS',
+                        ['sqlite:///' + str(tmp_path / 'replica.db')])
+    monkeypatch.setattr(Config, 'PASSWORD_POOL_SIZE', 0)
+    monkeypatch.setattr(Config, 'LOG_TO_STDOUT', '1')
+    app = create_app()
+    app.testing = True
+    with app.app_context():
+        db.create_all()
+    shutil.copyfile(str(tmp_path / 'primary.db'), str(tmp_path / 'replica.db'))
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.get_engine().dispose()
+        for engine in app.replicas.engines():
+            engine.dispose()
+    # NOTE: every application adds its handler to the same `app` logger.
+    for handler in list(app.logger.handlers):
+        app.logger.removeHandler(handler)
+        handler.close()
+
+
+@pytest.fixture
+def replicate(app, tmp_path):
+    """copies the primary to the replica, as if the replication caught up.
+    """
+    def replicate():
+        shutil.copyfile(str(tmp_path / 'primary.db'), str(tmp_path / 'replica.db'))
+    return replicate
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
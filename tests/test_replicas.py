@@ -0,0 +1,170 @@
+import base64
+import sqlite3
+
+from sqlalchemy import event, select
+
+from app import db
+from app.models import User
+
+
+def basic_auth(username, password):
+    credentials = '{}:{}'.format(username, password).encode('utf-8')
+    return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+
+
+def bearer_auth(token):
+    return {'Authorization': 'Bearer ' + token}
+
+
+def create_user(client, username):
+    response = client.post('/api/users', json={
+        'username': username, 'password': 'secret', 'email': username + '@example.com'})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def get_token(client, username):
+    response = client.post('/api/tokens', headers=basic_auth(username, 'secret'))
+    assert response.status_code == 200
+    return response.get_json()['token']
+
+
+def execute(path, sql, *params):
+    """runs `sql` on one of the SQLite files directly, behind the back of
+        the application.
+    """
+    connection = sqlite3.connect(str(path))
+    try:
+        rows = connection.execute(sql, params).fetchall()
+        connection.commit()
+        return rows
+    finally:
+        connection.close()
+
+
+def count_queries(engine):
+    queries = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: queries.append(args[2]))
+    return queries
+
+
+def expire_replica_lag(app):
+    """forgets the recent writes, as if `SQLALCHEMY_REPLICA_LAG` had passed.
+    """
+    for key in app.redis.keys('version:*:bumped'):
+        app.redis.delete(key)
+
+
+def test_get_reads_from_the_replica(app, client, replicate, tmp_path):
+    id = create_user(client, 'alice')
+    token = get_token(client, 'alice')
+    replicate()
+    execute(tmp_path / 'replica.db', 'UPDATE user SET username = ? WHERE id = ?',
+            'alice-replica', id)
+    expire_replica_lag(app)
+
+    response = client.get('/api/users/{}'.format(id), headers=bearer_auth(token))
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'alice-replica'
+
+
+def test_recent_writes_are_read_from_the_primary(app, client, replicate):
+    id = create_user(client, 'alice')
+    token = get_token(client, 'alice')
+    replicate()
+    expire_replica_lag(app)
+    response = client.put('/api/users/{}'.format(id), json={'username': 'alice2'},
+                          headers=bearer_auth(token))
+    assert response.status_code == 200
+
+    # the replica lags behind, the new ETag must come with the new body.
+    for url in ('/api/users/{}'.format(id), '/api/users'):
+        response = client.get(url, headers=bearer_auth(token))
+        assert response.status_code == 200
+        assert 'alice2' in response.get_data(as_text=True)
+        etag = response.headers['ETag']
+        replicate()
+        response = client.get(url, headers=dict(bearer_auth(token), **{'If-None-Match': etag}))
+        assert response.status_code == 304
+
+
+def test_writes_stay_on_the_primary(app, client, replicate, tmp_path):
+    id = create_user(client, 'alice')
+    token = get_token(client, 'alice')
+    replicate()
+    execute(tmp_path / 'replica.db', 'UPDATE user SET username = ? WHERE id = ?',
+            'stale', id)
+    # the token is looked up in the database again.
+    app.token_cache.local.clear()
+    app.redis.flushall()
+    replica_queries = count_queries(app.replicas.engines()[0])
+
+    response = client.put('/api/users/{}'.format(id), json={'email': 'bob@example.com'},
+                          headers=bearer_auth(token))
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'alice'
+    assert execute(tmp_path / 'primary.db', 'SELECT username, email FROM user') == [
+        ('alice', 'bob@example.com')]
+    assert execute(tmp_path / 'replica.db', 'SELECT username, email FROM user') == [
+        ('stale', 'alice@example.com')]
+
+    create_user(client, 'carol')
+    assert execute(tmp_path / 'primary.db', "SELECT id FROM user WHERE username = 'carol'")
+    assert not execute(tmp_path / 'replica.db', "SELECT id FROM user WHERE username = 'carol'")
+    assert replica_queries == []
+
+
+def test_reads_its_own_writes_after_a_flush(app):
+    with app.test_request_context('/api/users', method='GET'):
+        replica_queries = count_queries(app.replicas.engines()[0])
+        assert User.query.filter_by(username='dave').first() is None
+        assert replica_queries
+
+        user = User(username='dave', email='dave@example.com')
+        db.session.add(user)
+        db.session.flush()
+        count = len(replica_queries)
+        assert User.query.filter_by(username='dave').first() is user
+        assert len(replica_queries) == count
+        db.session.rollback()
+
+
+def test_failing_replica_is_ejected(app, client, tmp_path):
+    # nothing can be opened in a directory that does not exist.
+    app.replicas.uris = ['sqlite:///' + str(tmp_path / 'missing' / 'replica.db')]
+    id = create_user(client, 'alice')
+    token = get_token(client, 'alice')
+    expire_replica_lag(app)
+
+    # the query which found the replica dead runs again on the primary.
+    response = client.get('/api/users/{}'.format(id), headers=bearer_auth(token))
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'alice'
+    assert not app.replicas.is_healthy(app.replicas.engines()[0])
+
+    # so do the statements of the session.
+    app.replicas._ejected.clear()
+    with app.test_request_context('/api/users', method='GET'):
+        assert db.session.execute(select([User.username])).fetchall() == [('alice',)]
+        assert not app.replicas.is_healthy(app.replicas.engines()[0])
+        # the reads go to the primary until the replica comes back.
+        assert User.query.get(id).username == 'alice'
+
+
+def test_revoked_token_is_not_revived_by_the_replica(app, client, replicate, tmp_path):
+    create_user(client, 'alice')
+    token = get_token(client, 'alice')
+    replicate()
+    assert client.get('/api/users', headers=bearer_auth(token)).status_code == 200
+
+    assert client.delete('/api/tokens', headers=bearer_auth(token)).status_code == 204
+    # the replica lags behind, it still has the token.
+    assert execute(tmp_path / 'replica.db', 'SELECT token FROM user') == [(token,)]
+    assert client.get('/api/users', headers=bearer_auth(token)).status_code == 401
+
+    # neither once the token cache forgot about the revocation.
+    app.token_cache.local.clear()
+    app.token_cache.rejected.clear()
+    app.redis.flushall()
+    assert client.get('/api/users', headers=bearer_auth(token)).status_code == 401
+    assert client.get('/api/users', headers=bearer_auth(token)).status_code == 401
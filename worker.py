@@ -0,0 +1,67 @@
+"""Runs an rq worker on the task queues, in priority order:
+
+    $ python worker.py            # all the `TASK_QUEUES`, high first
+    $ python worker.py bulk       # dedicated workers for the bulk queue
+
+A worker always empties the first of its queues before taking a job from the
+next one, so a long export on the bulk queue never delays a short job as long
+as a worker is listening on the high queue.
+
+rq forks a work horse for every job. The application and the tasks are set up
+once here, in the parent, so a job only pays for the fork. The database and
+redis connections are opened lazily by every work horse, see `app.__init__`.
+The work horses write their logs to the file of their worker.
+"""
+import os
+import sys
+
+from flask import current_app
+from rq import Worker
+
+from app import create_app
+
+
+class AppWorker(Worker):
+    """A `Worker` which flushes the logs of the application after every job.
+    """
+
+    def perform_job(self, job, queue):
+        try:
+            return super(AppWorker, self).perform_job(job, queue)
+        finally:
+            # NOTE: the work horse leaves with `os._exit`, which neither runs
+            # `logging.shutdown` nor the listener thread of `app.log`.
+            for handler in current_app.logger.handlers:
+                handler.flush()
+
+
+def bootstrap():
+    """builds the application and imports the tasks in the parent process.
+
+    Returns:
+        Flask: the application, its context is pushed.
+    """
+    app = create_app()
+    # NOTE: set LOG_FILE_ID to a stable name, e.g. supervisor's
+    # `%(process_num)s`, so that a restarted worker reuses its log file.
+    app.config['LOG_FILE_ID'] = app.config['LOG_FILE_ID'] or str(os.getpid())
+    # the work horses inherit the pushed context and the imported tasks.
+    app.app_context().push()
+    from app import tasks  # noqa: F401
+    # closes the log file before the work horses append to it.
+    for handler in app.logger.handlers:
+        handler.flush()
+    return app
+
+
+def main(names):
+    app = bootstrap()
+    names = names or list(app.task_queues)
+    unknown = [name for name in names if name not in app.task_queues]
+    if unknown:
+        sys.exit('unknown task queue: {}'.format(', '.join(unknown)))
+    AppWorker([app.task_queues[name] for name in names], connection=app.redis).work()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])